@@ -1,18 +1,23 @@
 import os
 import numpy as np
 import pandas as pd
-from scipy.io import loadmat
 import nibabel as nib
 from functions import CopBET_CarhartHarris_2016_data
+from functions.helper_functions.duplicate_sessions import find_duplicate_sessions
+from functions.helper_functions.roi_mat_loader import load_roi_mats
 
 
-def CopBET_CarhartHarris_2016_data(atlas='yeo7', ts_ROI2ROI='denoised_volumes', type='example'):
+def CopBET_CarhartHarris_2016_data(atlas='yeo7', ts_ROI2ROI='denoised_volumes', type='example', cache=True,
+                                   n_threads=8):
     """
     Loads the CH2016 data structured according to the README file.
     Args:
         atlas (str, optional): Name of the atlas to use. Defaults to 'yeo7'.
         ts_ROI2ROI (str, optional): Type of data ('denoised_volumes' or other). Defaults to 'denoised_volumes'.
         type (str, optional): Whether to load 'full' dataset or 'example'. Defaults to 'example'. 
+        cache (bool, optional): Keep the ROI data of all sessions in one memory-mapped file per atlas in
+            ROIdata, so later loads skip the .mat files. Defaults to True.
+        n_threads (int, optional): Number of .mat files read in parallel. Defaults to 8.
     Returns:
         pandas.DataFrame: Dataframe containing metadata and file paths (or loaded data, if applicable).
         list: Placeholder for data, if applicable.
@@ -35,9 +40,8 @@ def CopBET_CarhartHarris_2016_data(atlas='yeo7', ts_ROI2ROI='denoised_volumes',
     opts = {'subjects': subs}  # Store subject names in opts
     # Table initialization
     tblvarnames = ['data', 'rp', 'subject', 'condition', 'session', 'num_vols', 'entropy']
-    tblvartypes = ['object', 'object', 'str', 'str', 'int', 'int', 'object']
-    tbl = pd.DataFrame(columns=tblvarnames)  # Create empty DataFrame 
-    tblcount = 0
+    # The rows are collected in lists and the table is built once
+    records = []
     for sub in subs:
         for cond in conditions:
             for ses in [1, 3]:
@@ -46,38 +50,35 @@ def CopBET_CarhartHarris_2016_data(atlas='yeo7', ts_ROI2ROI='denoised_volumes',
                     for potential_ext in ('.nii.gz', '_shortened.nii.gz'):
                         file_path = os.path.join(sub_folder, cond, 'func', f"{sub}_{cond}_task-rest_run-0{ses}_bold{potential_ext}")
                         if os.path.exists(file_path):
-                            tbl.loc[tblcount, 'data'] = file_path  # Use .loc for efficient assignment
                             break
                     else:
                         raise FileNotFoundError(f"Could not find denoised_volumes file for {sub}, {cond}, session {ses}")
                 else:
-                    data_path = os.path.join(topfolder, 'ROIdata', atlas, f'{sub}_{cond}_task-rest_run-0{ses}_bold.mat')
-                    if os.path.exists(data_path):
-                        V_roi = loadmat(data_path)['V_roi']
-                        tbl.loc[tblcount, 'data'] = V_roi
-                        tbl.loc[tblcount, 'num_vols'] = V_roi.shape[0]
-                    else:
-                        raise FileNotFoundError(f"Could not find ROI data file at {data_path}")
-                tbl.loc[tblcount, 'subject'] = sub
-                tbl.loc[tblcount, 'condition'] = cond
-                tbl.loc[tblcount, 'session'] = ses
-                tblcount += 1
-    
-    # Equality Check
+                    file_path = os.path.join(topfolder, 'ROIdata', atlas, f'{sub}_{cond}_task-rest_run-0{ses}_bold.mat')
+                    if not os.path.exists(file_path):
+                        raise FileNotFoundError(f"Could not find ROI data file at {file_path}")
+                records.append({'data': file_path, 'rp': None, 'subject': sub, 'condition': cond, 'session': ses,
+                                'num_vols': None, 'entropy': None})
+    tbl = pd.DataFrame(records, columns=tblvarnames)
+
+    # ROI data of all sessions is read in parallel, or from the consolidated cache
+    if ts_ROI2ROI != 'denoised_volumes':
+        cache_file = os.path.join(topfolder, 'ROIdata', f'.roi_cache_{atlas}_{type}') if cache else None
+        V_rois = load_roi_mats(tbl['data'].tolist(), 'V_roi', n_threads=n_threads, cache_file=cache_file)
+        tbl['data'] = pd.Series(V_rois, dtype=object)
+        tbl['num_vols'] = [V_roi.shape[0] for V_roi in V_rois]
+
+    # Equality Check: sessions of the same shape are fingerprinted and only colliding ones compared exactly
     if ts_ROI2ROI != 'denoised_volumes':
-        for h in range(len(tbl)):  # Outer loop
-            for h2 in range(h + 1, len(tbl)):  # Inner loop; starts from h+1
-                if tbl['num_vols'][h] == tbl['num_vols'][h2]:  # Compare number of volumes
-                    data1 = tbl['data'][h]
-                    data2 = tbl['data'][h2]
-                    # Note: Assuming your tbl['data'] elements are NumPy arrays or similar
-                    if np.linalg.norm(data1 - data2, 'fro') < 1:  # Frobenius norm check
-                        error_msg = f"Equality problem for {h}-{h2}"
-                        raise ValueError(error_msg)
+        duplicates = find_duplicate_sessions(tbl['data'].tolist(), tol=1)
+        if duplicates:
+            h, h2 = duplicates[0]
+            error_msg = f"Equality problem for {h}-{h2}"
+            raise ValueError(error_msg)
 
     data = []  # Placeholder for any data you want to return
 
-    tbl['data'] = tbl['data'].apply(np.array)
+    tbl['data'] = tbl['data'].apply(np.asarray)  # memory-mapped ROI data stays on disk
     return tbl, data, opts
 
 
@@ -2,6 +2,16 @@
 clear
 addpath(genpath(pwd))
 
+% In Python, the measures below are computed in one pass over the data
+% (every session loaded once, shared intermediates) by
+% functions/CopBET_entropy_batch.py:
+%   from functions import CopBET_entropy_batch
+%   tbl = CopBET_entropy_batch(tbl, ['metastate', 'dcc', 'degree', 'pl', 'sampen_roi', 'LZc'])
+% which adds the entropy_metastate, dcc_entropy, dcc_var, entropy_degree,
+% entropy_pl, entropy_sampen_roi and entropy_LZc columns. entropy_sampen_roi
+% is the sample entropy of the region time series, not the region average
+% of voxelwise sample entropy of CopBET_sample_entropy on volumes.
+
 
 %% Metastate series complexity (<1 minute on example data)
 tbl_metastate = CopBET_metastate_series_complexity(tbl,'keepdata',true,'parallel',true);
@@ -0,0 +1,114 @@
+import os
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+import nibabel as nib
+import numpy as np
+from nilearn import datasets
+from nilearn import image
+from nilearn import input_data
+
+# the local atlases are resolved by the CopBET functions' atlas_path, so both name them the same way
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+from functions.helper_functions.atlas_parcellation import atlas_path, local_atlases  # noqa: E402
+
+"""
+
+Lazy registry of the atlases process_data_bids can extract time series with.
+
+Only the requested atlas is fetched (nilearn atlases) or read (the local Atlases/*_2mm.nii files, e.g. 'Schaefer1000',
+'AAL90', 'Yeo17_liberal', or an atlas NIfTI path, resolved by atlas_path of the CopBET functions), so startup does
+not depend on how many atlases are supported. The atlas image, its label values and region names, and the fitted
+NiftiLabelsMasker are built once per atlas and process and then reused for every file; worker processes get the
+fitted maskers once when they start. Runs on the same voxel grid (shape and affine, e.g. all fMRIPrep outputs in one
+MNI space) share one masker whose atlas was resampled to that grid once.
+
+"""
+
+Atlas = namedtuple('Atlas', ['name', 'labels_img', 'label_values', 'labels'])
+
+
+def _schaefer(n_rois):
+    atlas = datasets.fetch_atlas_schaefer_2018(n_rois=n_rois)
+    return atlas.maps, [label.decode() if isinstance(label, bytes) else label for label in atlas.labels]
+
+
+def _yeo17():
+    return datasets.fetch_atlas_yeo_2011()['thin_17'], None
+
+
+# name -> fetcher returning (labels image or filename, region names or None), only called for the requested atlas
+ATLAS_FETCHERS = {
+    'schaefer400': lambda: _schaefer(400),
+    'schaefer1000': lambda: _schaefer(1000),
+    'yeo17': _yeo17,
+}
+
+
+def register_atlas(name, fetcher):
+    """Adds an atlas to the registry; fetcher() returns (labels image or filename, region names or None)."""
+    ATLAS_FETCHERS[name] = fetcher
+    get_atlas.cache_clear()
+    get_masker.cache_clear()
+
+
+def available_atlases():
+    return list(ATLAS_FETCHERS) + [name for name in local_atlases() if name not in ATLAS_FETCHERS]
+
+
+@lru_cache(maxsize=None)
+def get_atlas(atlas_name):
+    """The atlas image (in memory, integer labels), its non-zero label values and region names, loaded once."""
+    if atlas_name in ATLAS_FETCHERS:
+        labels_img, labels = ATLAS_FETCHERS[atlas_name]()
+    else:
+        try:
+            path = atlas_path(atlas_name)
+        except ValueError:
+            raise ValueError(f"Atlas not supported. Available options: {', '.join(available_atlases())}") from None
+        labels_img, labels = path, _local_labels(path)
+
+    img = nib.load(labels_img) if isinstance(labels_img, str) else labels_img
+    data = np.rint(np.asanyarray(img.dataobj)).astype(np.int32)
+    img = nib.Nifti1Image(data, img.affine)
+    label_values = np.unique(data)
+    label_values = label_values[label_values != 0]
+    label_values.setflags(write=False)
+    return Atlas(atlas_name, img, label_values, labels)
+
+
+def acquisition_grid(func_file):
+    """(shape, affine) of the voxel grid of a functional file, read from its header only; hashable."""
+    img = nib.load(func_file)
+    return tuple(img.shape[:3]), tuple(img.affine.ravel().tolist())
+
+
+@lru_cache(maxsize=None)
+def get_masker(atlas_name, masker_params=(), grid=None):
+    """
+    NiftiLabelsMasker of an atlas, fitted once per atlas, masker parameters (given as a tuple of items so they can
+    be part of the cache key) and grid, and shared by all files. With a grid from acquisition_grid the atlas is
+    resampled to it once here, so transforming a run on that grid does no resampling; without one the atlas is
+    resampled to every run when it is transformed.
+    """
+    labels_img = get_atlas(atlas_name).labels_img
+    params = dict(masker_params)
+    if grid is not None:
+        shape, affine = grid
+        affine = np.reshape(affine, (4, 4))
+        if labels_img.shape != shape or not np.array_equal(labels_img.affine, affine):
+            labels_img = image.resample_img(labels_img, target_affine=affine, target_shape=shape,
+                                            interpolation='nearest')
+        params['resampling_target'] = None
+    masker = input_data.NiftiLabelsMasker(labels_img=labels_img, verbose=2, **params)
+    return masker.fit()
+
+
+def _local_labels(path):
+    # region names, one per line, in the .txt file next to the atlas (not every atlas has one)
+    txt = path[:-len('.nii')] + '.txt'
+    if not os.path.exists(txt):
+        return None
+    with open(txt) as f:
+        return [line.strip() for line in f if line.strip()]
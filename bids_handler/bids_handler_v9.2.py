@@ -1,10 +1,12 @@
-from bids import BIDSLayout
-from nilearn import datasets
-from nilearn import input_data
 from nilearn.interfaces.fmriprep import load_confounds
 import os
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from atlas_registry import acquisition_grid, get_atlas, get_masker
+from bids_index import BIDSIndex, index_filename
+from timeseries_cache import cache_key, load_cached, save_cached
+from timeseries_store import run_filename, save_run, update_index
 
 """
 
@@ -14,6 +16,23 @@ v9.2 updates
 - included scrubbing for compcor and gsr
 - created separate if statements for gsr and compcor when doing time series extraction with confounds[0] specification for gsr
 - added confound regression specification (gsr/compcor) to csv file name
+- extracted time series are cached on disk (cache_dir, default save_path/ts_cache), keyed by a hash of bold file, mtime,
+  atlas, strategy and confound parameters, so reruns and atlas/strategy sweeps skip files that were already extracted
+  and interrupted jobs resume where they stopped
+- parallel extraction (n_workers) in a process pool, capped by a memory budget per worker (memory_per_worker_gb);
+  outputs and their order are the same as for the serial run, progress is printed per file
+- runs are saved as float32 .npy files plus an index.csv with dataset/subject/session/task/atlas/conreg (see timeseries_store,
+  load_runs reads back a subset); save_format='csv' keeps the old per-run csv files
+- the function returns one row per run (data column with the time x ROI array, categorical metadata columns) instead of
+  one long dataframe with the metadata repeated for every volume
+- files are found with BIDSIndex (see bids_index) instead of BIDSLayout: a parallel scandir walk whose result is kept in
+  an on-disk index (cache_dir, or the BIDS root) and only re-read for directories that changed; indexer='pybids' uses
+  BIDSLayout as before
+- atlases are resolved lazily by atlas_registry: only the requested one is fetched, the local Atlases/*.nii files
+  (e.g. 'AAL90', 'Schaefer1000') can be used too, and the masker is fitted once per atlas and reused for every file
+  (worker processes receive the fitted masker once), so each run is only transformed
+- functional files are grouped by voxel grid (shape, affine): the atlas is resampled once per grid and the masker fitted
+  on the resampled atlas, so runs sharing an fMRIPrep output space are transformed without any resampling
 
 - ! Change derivatives to true for cluster data, and to false for nilearn data
 - !! Look into changing the framewise displacement when using a different atlas (higher number of regions means frame wise displacement is affected)
@@ -22,35 +41,56 @@ v9.2 updates
 """
 
 
-def process_data_bids(bids_root, strategy, atlas_name, save_path, save_data=False, limit_subjects=False):
+# load_confounds parameters per confound regression strategy
+CONFOUND_PARAMS = {
+    'gsr': dict(strategy=["motion", "global_signal", "high_pass", "wm_csf"],
+                motion='basic',
+                global_signal='basic',  # basic for gsr is often sufficient unless specific reasons
+                scrub=0,
+                fd_threshold=0.5,
+                std_dvars_threshold=1.5),
+    'compcor': dict(strategy=['motion', "high_pass", "scrub", "compcor", "wm_csf"],  # using both wm and csf as compcor regressors
+                    motion="basic",
+                    compcor='anat_combined',
+                    n_compcor='all',
+                    scrub=0,
+                    fd_threshold=0.5,
+                    std_dvars_threshold=1.5),  # check whether this is correct # all components = 50 percent of variance explained
+}
+
+MASKER_PARAMS = dict(standardize=True)
+
+
+def process_data_bids(bids_root, strategy, atlas_name, save_path, save_data=False, limit_subjects=False, cache_dir=None,
+                      n_workers=1, memory_per_worker_gb=None, save_format='npy', indexer='fast'):
     print("BIDS root:", bids_root)
     print("Directories and files at BIDS root:", os.listdir(bids_root))
 
-    atlases = {
-        'schaefer400': datasets.fetch_atlas_schaefer_2018(n_rois=400),
-        'schaefer1000': datasets.fetch_atlas_schaefer_2018(n_rois=1000),
-        'yeo17': datasets.fetch_atlas_yeo_2011()
-    }
-    if atlas_name not in atlases:
-        raise ValueError(f"Atlas not supported. Available options: {', '.join(atlases.keys())}")
-
-    atlas_data = atlases[atlas_name]
-    if atlas_name == 'yeo17':
-        atlas_filename = atlas_data['thin_17']
+    # only the requested atlas is fetched, the maskers fitted on it are reused for every file (see atlas_registry)
+    get_atlas(atlas_name)
+
+    if save_format not in ('npy', 'csv'):
+        raise ValueError(f"Unknown save format: {save_format}. Available options: npy, csv")
+    if strategy not in CONFOUND_PARAMS:
+        raise ValueError(f"Unknown strategy: {strategy}. Available options: gsr, compcor")
+    if cache_dir is None and save_path is not None:
+        cache_dir = os.path.join(save_path, 'ts_cache')
+
+    if indexer == 'fast':
+        layout = BIDSIndex(bids_root, derivatives=True, index_file=index_filename(cache_dir, bids_root) if cache_dir else None)
+    elif indexer == 'pybids':
+        from bids import BIDSLayout
+        layout = BIDSLayout(bids_root, validate=False, derivatives=True, absolute_paths=True)
     else:
-        atlas_filename = atlas_data.maps
-
-    layout = BIDSLayout(bids_root, validate=False, derivatives=True, absolute_paths=True)
-
-    masker = input_data.NiftiLabelsMasker(labels_img=atlas_filename, standardize=True, verbose=2)
+        raise ValueError(f"Unknown indexer: {indexer}. Available options: fast, pybids")
 
     subjects = layout.get_subjects()
 
     if limit_subjects:  # alternative option to run the code more quickly, change number of subjects to your preference
         subjects = subjects[:1]  # change number to desired number of participants to preprocess
 
-    all_dfs = []
-
+    # Collect all runs first, the extraction itself can then run in parallel
+    runs = []
     for subject_id in subjects:
         sessions = layout.get_sessions(subject=subject_id) or [None]  # handle data sets without sessions
         for session in sessions:
@@ -63,62 +103,120 @@ def process_data_bids(bids_root, strategy, atlas_name, save_path, save_data=Fals
             for func_file in func_files:
                 task = layout.get_metadata(func_file).get('TaskName', 'unknown')
                 print(f"TaskName for file {func_file}: {task}")
-                sample_mask = None
-                if strategy == 'gsr':
-                    confounds = load_confounds(func_file, strategy=["motion", "global_signal", "high_pass", "wm_csf"],
-                                               motion ='basic',
-                                               global_signal='basic', # basic for gsr is often sufficient unless specific reasons
-                                               scrub=0,
-                                               fd_threshold=0.5,
-                                               std_dvars_threshold=1.5) 
-                elif strategy == 'compcor':
-                    confounds, sample_mask = load_confounds(func_file, strategy=['motion', "high_pass", "scrub", "compcor", "wm_csf"],  # using both wm and csf as compcor regressors
-                                                            motion="basic",
-                                                            compcor='anat_combined',
-                                                            n_compcor='all',
-                                                            scrub=0,
-                                                            fd_threshold=0.5,
-                                                            std_dvars_threshold=1.5)  # check whether this is correct # all components = 50 percent of variance explained
-                else:
-                    raise ValueError(f"Unknown strategy: {strategy}. Available options: gsr, compcor")
-
-                if strategy == 'gsr':
-                    time_series = masker.fit_transform(func_file, confounds=confounds[0], sample_mask=sample_mask)
-
-                elif strategy == 'compcor':
-                    time_series = masker.fit_transform(func_file, confounds=confounds, sample_mask=sample_mask)
-
-                    
-                if time_series.size == 0:
-                    print(f"Empty time series for file {func_file}.")
-                    continue
-                print(f"Time series shape for file {func_file}: {time_series.shape}")
+                runs.append((subject_id, session, task, func_file))
+
+    all_time_series = extract_runs([run[3] for run in runs], atlas_name, strategy, cache_dir=cache_dir,
+                                   n_workers=n_workers, memory_per_worker_gb=memory_per_worker_gb)
+
+    dataset = os.path.basename(bids_root)
+    rows = []
+    records = []
+
+    for (subject_id, session, task, func_file), time_series in zip(runs, all_time_series):
+        if time_series.size == 0:
+            print(f"Empty time series for file {func_file}.")
+            continue
+        print(f"Time series shape for file {func_file}: {time_series.shape}")
+
+        # one row per run, the data column holds the time x ROI array
+        rows.append({'data': time_series.astype(np.float32), 'dataset': dataset, 'subject': subject_id, 'session': session,
+                     'task': task, 'atlas': atlas_name, 'conreg': strategy})
 
+        if save_data:
+            if save_format == 'csv':
                 df = pd.DataFrame(time_series, columns=[f'Region_{i}' for i in range(time_series.shape[1])])
+                file_name = run_filename(dataset, subject_id, session, task, atlas_name, strategy, extension='.csv')
+                df.to_csv(os.path.join(save_path, file_name), index=False)  # save data
+            else:
+                record = save_run(save_path, time_series, dataset, subject_id, session, task, atlas_name, strategy)
+                records.append(record)
+                file_name = record['file']
+            print(f"Saved data for dataset {dataset} to {file_name}")
+
+    if records:
+        update_index(save_path, records)
+
+    runs_table = pd.DataFrame(rows, columns=['data', 'dataset', 'subject', 'session', 'task', 'atlas', 'conreg'])
+    for column in runs_table.columns[1:]:
+        runs_table[column] = runs_table[column].astype('category')
+    return runs_table
+
+
+def extract_runs(func_files, atlas_name, strategy, cache_dir=None, n_workers=1, memory_per_worker_gb=None):
+    """
+    Time series of every file in func_files, in the same order, extracted serially or in a process pool.
+    The files are grouped by voxel grid (shape and affine); the atlas is resampled to every grid and its masker
+    fitted once, after which each run is only transformed.
+    """
+    results = [None] * len(func_files)
+    keys = [cache_key(f, atlas_name, strategy, {'confounds': CONFOUND_PARAMS[strategy], 'masker': MASKER_PARAMS}) for f in func_files]
+
+    todo = []
+    for i, (func_file, key) in enumerate(zip(func_files, keys)):
+        results[i] = load_cached(cache_dir, key) if cache_dir else None
+        if results[i] is not None:
+            print(f"Loaded cached time series for file {func_file}")
+        else:
+            todo.append(i)
+
+    grids = {i: acquisition_grid(func_files[i]) for i in todo}
+    maskers = {grid: get_masker(atlas_name, tuple(sorted(MASKER_PARAMS.items())), grid) for grid in set(grids.values())}
+
+    n_workers = worker_cap(n_workers, memory_per_worker_gb, len(todo))
+    print(f"Extracting {len(todo)} of {len(func_files)} files on {len(maskers)} voxel grid(s) with {n_workers} worker(s)")
+
+    def finish(count, i, time_series):
+        results[i] = time_series
+        if cache_dir and time_series.size:
+            save_cached(cache_dir, keys[i], time_series)
+        print(f"[{count}/{len(todo)}] Extracted {func_files[i]}")
+
+    if n_workers <= 1:
+        for count, i in enumerate(todo, 1):
+            finish(count, i, extract_time_series(func_files[i], maskers[grids[i]], strategy))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(maskers,)) as pool:
+            futures = {pool.submit(_extract_in_worker, func_files[i], grids[i], strategy): i for i in todo}
+            for count, future in enumerate(as_completed(futures), 1):
+                finish(count, futures[future], future.result())
+    return results
+
+
+def worker_cap(n_workers, memory_per_worker_gb, n_jobs):
+    """Number of workers that fits both the requested cap and the available memory."""
+    n_workers = max(1, min(n_workers, n_jobs))
+    if memory_per_worker_gb:
+        try:
+            available_gb = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2**30
+        except (ValueError, OSError, AttributeError):  # no sysconf (Windows)
+            return n_workers
+        n_workers = max(1, min(n_workers, int(available_gb // memory_per_worker_gb)))
+    return n_workers
+
 
-                if df.empty:
-                    print(f"Entries for dataframe are empty for file {func_file}.")
-                    continue
+_worker_maskers = None
 
-                # Print DataFrame columns for debugging
-                print(f"DataFrame columns: {df.columns}")
 
-                # Create a copy of the dataframe and add additional columns for the final concatenated dataframe 
-                final_df = df.copy()
-                final_df['Dataset'] = os.path.basename(bids_root)  # add dataset name to dataframe
-                final_df['Subject'] = subject_id
-                final_df['Session'] = session
-                final_df['Task'] = task
-                all_dfs.append(final_df)
+def _init_worker(maskers):
+    global _worker_maskers
+    _worker_maskers = maskers
 
-                if save_data:
-                    dataset = os.path.basename(bids_root)
-                    csv_filename = f"dat-{dataset}_sub-{subject_id}_task-{task}_ses-{session}_atlas-{atlas_name}_conreg-{strategy}.csv" 
-                    df.to_csv(os.path.join(save_path, csv_filename), index=False)  # save data
-                    print(f"Saved data for dataset {dataset} to {csv_filename}")
 
-    final_combined_df = pd.concat(all_dfs, ignore_index=True) if all_dfs else pd.DataFrame()  # concatenate all dataframes
-    return final_combined_df
+def _extract_in_worker(func_file, grid, strategy):
+    return extract_time_series(func_file, _worker_maskers[grid], strategy)
+
+
+def extract_time_series(func_file, masker, strategy):
+    sample_mask = None
+    if strategy == 'gsr':
+        confounds = load_confounds(func_file, **CONFOUND_PARAMS['gsr'])
+        time_series = masker.transform(func_file, confounds=confounds[0], sample_mask=sample_mask)
+    elif strategy == 'compcor':
+        confounds, sample_mask = load_confounds(func_file, **CONFOUND_PARAMS['compcor'])
+        time_series = masker.transform(func_file, confounds=confounds, sample_mask=sample_mask)
+    else:
+        raise ValueError(f"Unknown strategy: {strategy}. Available options: gsr, compcor")
+    return time_series
 
 
 #### DEFINE PATHS ####
@@ -140,7 +238,8 @@ save_path = r"/home/s1836706/data_pi-michielvanelkm/Olivier/preprocessed_csv"
 
 #### CALL FUNCTION ####
 
-strategy = 'gsr'
-atlas_name = "schaefer1000"
-results = process_data_bids(bids_root, strategy, atlas_name, save_path, save_data=True, limit_subjects=True)
-print(results)
+if __name__ == '__main__':  # worker processes import this file, they must not run the pipeline
+    strategy = 'gsr'
+    atlas_name = "schaefer1000"
+    results = process_data_bids(bids_root, strategy, atlas_name, save_path, save_data=True, limit_subjects=True)
+    print(results)
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+"""
+
+Lightweight file index of a BIDS dataset (and its derivatives), used instead of pybids' BIDSLayout.
+
+The tree is walked with os.scandir by a thread pool, one directory per task, and the BIDS entities of every file are
+parsed from its name once. The result is stored as json together with the modification time of every directory.
+On the next run only the directories are stat-ed: a directory whose mtime is unchanged has the same entries, so its
+stored listing is reused and only new or changed directories are read again. The index answers the queries
+process_data_bids makes (get_subjects, get_sessions, get, get_metadata) with the same arguments as BIDSLayout.
+
+"""
+
+INDEX_VERSION = 1
+# folders BIDSLayout leaves out by default
+IGNORED_DIRS = {'code', 'sourcedata', 'stimuli', 'models'}
+ENTITY_NAMES = {'sub': 'subject', 'ses': 'session', 'acq': 'acquisition', 'ce': 'ceagent', 'rec': 'reconstruction',
+                'dir': 'direction', 'mod': 'modality', 'trc': 'tracer', 'inv': 'inversion', 'mt': 'mt', 'part': 'part'}
+
+
+def extract_entities_from_filename(filename):
+    """BIDS entities of a file name, e.g. {'subject': '01', 'task': 'rest', 'suffix': 'bold', 'extension': '.nii.gz'}."""
+    stem, dot, extension = filename.partition('.')
+    parts = stem.split('_')
+    entities = {}
+    for part in parts[:-1]:
+        if '-' in part:
+            key, value = part.split('-', 1)
+            entities[ENTITY_NAMES.get(key, key)] = value
+    if '-' in parts[-1]:
+        key, value = parts[-1].split('-', 1)
+        entities[ENTITY_NAMES.get(key, key)] = value
+    else:
+        entities['suffix'] = parts[-1]
+    entities['extension'] = dot + extension
+    return entities
+
+
+class BIDSIndex:
+    """
+    Index of the files in a BIDS dataset.
+
+    Example:
+        layout = BIDSIndex(bids_root, derivatives=True, index_file='bids_index.json')
+        layout.get(subject='01', session=None, suffix='bold', extension='nii.gz', return_type='filename')
+
+    Args:
+        root (str): The BIDS root folder.
+        derivatives (bool, optional): Also index root/derivatives. Defaults to True.
+        index_file (str, optional): Where the index is stored. Defaults to .bids_index.json in root; if that folder
+            is read-only the index is rebuilt every time.
+        n_threads (int, optional): Directories read in parallel. Defaults to 8.
+    """
+
+    def __init__(self, root, derivatives=True, index_file=None, n_threads=8):
+        self.root = os.path.abspath(root)
+        self.derivatives = derivatives
+        self.index_file = index_file or os.path.join(self.root, '.bids_index.json')
+        self.n_threads = n_threads
+        stored = self._load()
+        self._dirs = self._walk(stored)
+        if self._dirs != stored:
+            self._save()
+        self.files = [(os.path.join(self.root, rel, name), entities)
+                      for rel in sorted(self._dirs) for name, entities in sorted(self._dirs[rel]['files'].items())]
+        self._metadata = {}
+        self._sidecars = None
+
+    def __len__(self):
+        return len(self.files)
+
+    def __repr__(self):
+        return f"BIDSIndex({self.root!r}, {len(self)} files)"
+
+    def get(self, return_type='filename', **filters):
+        """
+        Files matching all entity filters, e.g. get(subject='01', suffix='bold', extension='nii.gz'). A filter value
+        can be a list of values; None matches files without that entity, as in BIDSLayout.
+        """
+        if 'extension' in filters:
+            filters['extension'] = _extension(filters['extension'])
+        matches = [(path, entities) for path, entities in self.files if _matches(entities, filters)]
+        if return_type == 'filename':
+            return [path for path, _ in matches]
+        return matches
+
+    def get_entities(self, name, **filters):
+        """Sorted values of one entity among the files matching filters."""
+        return sorted({entities[name] for _, entities in self.get('tuple', **filters) if name in entities})
+
+    def get_subjects(self, **filters):
+        return self.get_entities('subject', **filters)
+
+    def get_sessions(self, **filters):
+        return self.get_entities('session', **filters)
+
+    def get_metadata(self, path):
+        """
+        Sidecar metadata of a file, following the BIDS inheritance principle: the .json files with the same suffix
+        whose entities are a subset of the file's, from the top of its dataset (raw or derivative, whichever has the
+        closest dataset_description.json) down to the file's folder, are merged.
+        """
+        path = os.path.abspath(path)
+        entities = extract_entities_from_filename(os.path.basename(path))
+        entities.pop('extension')
+        folder = os.path.dirname(path)
+        top = self._dataset_root(folder)
+        sidecars = []
+        if self._sidecars is None:
+            self._sidecars = {}
+            for candidate, json_entities in self.get('tuple', extension='.json'):
+                self._sidecars.setdefault(json_entities.get('suffix'), []).append((candidate, json_entities))
+        for candidate, json_entities in self._sidecars.get(entities.get('suffix'), []):
+            json_folder = os.path.dirname(candidate)
+            if os.path.commonpath([json_folder, folder]) != json_folder or os.path.commonpath([json_folder, top]) != top:
+                continue
+            if all(entities.get(k) == v for k, v in json_entities.items() if k != 'extension'):
+                sidecars.append((json_folder.count(os.sep), len(json_entities), candidate))
+        metadata = {}
+        for _, _, sidecar in sorted(sidecars):
+            metadata.update(self._read_json(sidecar))
+        return metadata
+
+    def _dataset_root(self, folder):
+        while folder != self.root and folder.startswith(self.root):
+            listing = self._dirs.get(os.path.relpath(folder, self.root))
+            if listing is not None and 'dataset_description.json' in listing['files']:
+                return folder
+            folder = os.path.dirname(folder)
+        return self.root
+
+    def _read_json(self, path):
+        if path not in self._metadata:
+            with open(path) as f:
+                self._metadata[path] = json.load(f)
+        return self._metadata[path]
+
+    def _walk(self, stored):
+        # directory listings by path relative to root, read in parallel; unchanged directories reuse the stored one
+        dirs = {}
+        with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            pending = {pool.submit(_list_dir, self.root, '', stored.get('')): ''}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel = pending.pop(future)
+                    listing = future.result()
+                    if listing is None:  # removed while walking
+                        continue
+                    dirs[rel] = listing
+                    for sub in listing['subdirs']:
+                        if not self._include(rel, sub):
+                            continue
+                        sub_rel = os.path.join(rel, sub)
+                        pending[pool.submit(_list_dir, self.root, sub_rel, stored.get(sub_rel))] = sub_rel
+        return dirs
+
+    def _include(self, rel, name):
+        if name.startswith('.') or name in IGNORED_DIRS:
+            return False
+        return self.derivatives or rel != '' or name != 'derivatives'
+
+    def _load(self):
+        try:
+            with open(self.index_file) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if stored.get('version') != INDEX_VERSION or stored.get('root') != self.root:
+            return {}
+        return stored['dirs']
+
+    def _save(self):
+        content = {'version': INDEX_VERSION, 'root': self.root, 'dirs': self._dirs}
+        folder = os.path.dirname(os.path.abspath(self.index_file))
+        try:
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=folder, suffix='.json.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(content, f)
+            os.replace(tmp, self.index_file)
+        except OSError:  # read-only folder, index again next time
+            pass
+
+
+def index_filename(cache_dir, bids_root):
+    """Index file for a BIDS root in a cache folder, e.g. next to the time series cache."""
+    digest = hashlib.sha256(os.path.abspath(bids_root).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"bids_index_{os.path.basename(os.path.abspath(bids_root))}_{digest}.json")
+
+
+def _list_dir(root, rel, stored):
+    path = os.path.join(root, rel)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if stored is not None and stored['mtime_ns'] == mtime:
+            return stored
+        files, subdirs = {}, []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.is_file() and not entry.name.startswith('.'):
+                    files[entry.name] = extract_entities_from_filename(entry.name)
+    except FileNotFoundError:
+        return None
+    return {'mtime_ns': mtime, 'files': files, 'subdirs': sorted(subdirs)}
+
+
+def _extension(value):
+    if isinstance(value, (list, tuple, set)):
+        return [_extension(v) for v in value]
+    return value if value is None or value.startswith('.') else '.' + value
+
+
+def _matches(entities, filters):
+    for key, value in filters.items():
+        if value is None:
+            if key in entities:
+                return False
+        elif isinstance(value, (list, tuple, set)):
+            if entities.get(key) not in value:
+                return False
+        elif entities.get(key) != value:
+            return False
+    return True
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+"""
+
+On-disk cache for extracted ROI time series.
+
+Every entry is one .npy file named after a hash of everything that determines the extracted time series:
+the bold file (path, size and modification time), the atlas, the confound strategy and the confound/masker parameters.
+Changing any of these gives a new key, so atlas/strategy sweeps never read stale results, and a rerun after an
+interrupted job only extracts the files that are not in the cache yet.
+
+"""
+
+
+def cache_key(func_file, atlas_name, strategy, params):
+    stat = os.stat(func_file)
+    content = {
+        'func_file': os.path.abspath(func_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'atlas': atlas_name,
+        'strategy': strategy,
+        'params': params,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_cached(cache_dir, key):
+    path = os.path.join(cache_dir, f"{key}.npy")
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
+
+
+def save_cached(cache_dir, key, time_series):
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first, a killed job must never leave a truncated entry behind
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npy.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, time_series)
+    os.replace(tmp, os.path.join(cache_dir, f"{key}.npy"))
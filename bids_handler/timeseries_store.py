@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+"""
+
+Binary store for extracted ROI time series.
+
+Every run is one float32 .npy file (time x ROI) named like the csv files (dat-..._sub-..._task-..._ses-..._atlas-..._conreg-...),
+and index.csv holds one row of metadata per run (dataset, subject, session, task, atlas, conreg, file, n_vols, n_rois).
+Loading a subset of runs only reads the index and the .npy files of that subset, which are memory-mapped.
+
+"""
+
+INDEX_FILE = 'index.csv'
+META_COLUMNS = ['dataset', 'subject', 'session', 'task', 'atlas', 'conreg']
+
+
+def run_filename(dataset, subject, session, task, atlas, conreg, extension='.npy'):
+    return f"dat-{dataset}_sub-{subject}_task-{task}_ses-{session}_atlas-{atlas}_conreg-{conreg}{extension}"
+
+
+def save_run(store_dir, time_series, dataset, subject, session, task, atlas, conreg):
+    """Writes one run as float32 .npy and returns its index record."""
+    os.makedirs(store_dir, exist_ok=True)
+    file_name = run_filename(dataset, subject, session, task, atlas, conreg)
+    time_series = np.asarray(time_series, dtype=np.float32)
+    fd, tmp = tempfile.mkstemp(dir=store_dir, suffix='.npy.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, time_series)
+    os.replace(tmp, os.path.join(store_dir, file_name))
+    return {'dataset': dataset, 'subject': subject, 'session': session, 'task': task, 'atlas': atlas, 'conreg': conreg,
+            'file': file_name, 'n_vols': time_series.shape[0], 'n_rois': time_series.shape[1]}
+
+
+def update_index(store_dir, records):
+    """Adds run records to the index, replacing older records of the same files."""
+    index = pd.concat([load_index(store_dir), pd.DataFrame(records)], ignore_index=True)
+    index = index.drop_duplicates(subset='file', keep='last').reset_index(drop=True)
+    fd, tmp = tempfile.mkstemp(dir=store_dir, suffix='.csv.tmp')
+    with os.fdopen(fd, 'w', newline='') as f:
+        index.to_csv(f, index=False)
+    os.replace(tmp, os.path.join(store_dir, INDEX_FILE))
+    return index
+
+
+def load_index(store_dir):
+    path = os.path.join(store_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=META_COLUMNS + ['file', 'n_vols', 'n_rois'])
+    return pd.read_csv(path, dtype={col: str for col in META_COLUMNS})
+
+
+def load_runs(store_dir, mmap=True, **filters):
+    """
+    Table with one row per run (data column first, as CopBET functions expect), e.g.
+    load_runs(store_dir, dataset='basel_LAM', atlas='yeo17', conreg='gsr'). Filter values can be single values or lists.
+    """
+    index = load_index(store_dir)
+    for column, value in filters.items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        index = index[index[column].isin([str(v) for v in values])]
+    data = [np.load(os.path.join(store_dir, f), mmap_mode='r' if mmap else None) for f in index['file']]
+    return pd.concat([pd.DataFrame({'data': data}, index=index.index), index], axis=1).reset_index(drop=True)
@@ -48,6 +48,7 @@
 import numpy as np
 from scipy.signal import hilbert
 import nibabel as nib
+from functions.helper_functions.lz76_complexity import lz76_complexity
 
 def load_nifti_data(file_path):
     nifti_img = nib.load(file_path)
@@ -113,22 +114,18 @@ def CopBET_time_series_complexity(input_data, LZtype, **kwargs):
         M_rand = (random_ts > mean_bold)
 
         # Perform complexity calculations
-        C = np.empty(ts.shape[1])
-        C_rand = np.empty(ts.shape[1])
-
-        if LZtype in ['LZ78temporal', 'LZ76temporal']:
-            longts = bin_abs_hts.flatten()
-            C = cpr(longts)  # Placeholder for complexity calculation
-            long_rand = M_rand.flatten()
-            C_rand = cpr(long_rand)  # Placeholder for random complexity calculation
-
-        elif LZtype in ['LZ78spatial', 'LZ76spatial']:
+        if LZtype in ['LZ78spatial', 'LZ76spatial']:
             bin_abs_hts = bin_abs_hts.T
             M_rand = M_rand.T
 
-            longts = bin_abs_hts.flatten()
+        longts = bin_abs_hts.flatten()
+        long_rand = M_rand.flatten()
+
+        if LZtype in ['LZ76temporal', 'LZ76spatial']:
+            C = lz76_complexity(longts.astype(bool))
+            C_rand = lz76_complexity(long_rand.astype(bool))
+        else:
             C = cpr(longts)  # Placeholder for complexity calculation
-            long_rand = M_rand.flatten()
             C_rand = cpr(long_rand)  # Placeholder for random complexity calculation
 
         # Calculate and store the entropy
@@ -226,70 +223,11 @@ def calc_lz_complexity(S, type, normalize):
         raise ValueError("'normalize' must be a scalar")
     if type.lower() not in ['exhaustive', 'primitive']:
         raise ValueError("''type'' parameter is not valid, must be either 'exhaustive' or 'primitive'")
-    
-    S = np.array(S, dtype=bool)
-    normalize = bool(normalize)
-    L = len(S)
-    gs = np.zeros(L + 1, dtype=int)
-    gs[0] = 0
-
-    S_string = binary_seq_to_string(S)
-    gs[1] = 1
-
-    for n in range(1, L):
-        eigenvalue_found = False
-        idx_list = np.arange(gs[n] + 1, n + 1)
-        for k in range(int(np.ceil(len(idx_list) / 2))):
-            m_upper = idx_list[-k - 1]
-            if not S_string[:n].find(S_string[m_upper - 1:n]) >= 0:
-                gs[n + 1] = m_upper
-                eigenvalue_found = True
-                break
-
-            m_lower = idx_list[k]
-            if S_string[:n].find(S_string[m_lower - 1:n]) >= 0:
-                gs[n + 1] = m_lower - 1
-                eigenvalue_found = True
-                break
-            elif m_upper == m_lower + 1:
-                gs[n + 1] = m_lower
-                eigenvalue_found = True
-                break
-
-        if not eigenvalue_found:
-            raise ValueError('Internal error: could not find eigenvalue')
-
-    if type.lower() == 'exhaustive':
-        h_i = np.zeros(len(gs), dtype=int)
-        h_i_length = 1
-        h_prev = 0
-        while True:
-            k = np.argmax(gs[(h_prev + 2):] > h_prev) + 1
-            if k > 0:
-                h_i_length += 1
-                h_prev += k
-                h_i[h_i_length - 1] = h_prev
-            else:
-                break
-    else:
-        _, n = np.unique(gs, return_index=True)
-        h_i_length = len(n)
-        h_i = n - 1
-
-    if h_i[h_i_length - 1] != L:
-        h_i_length += 1
-        h_i[h_i_length - 1] = L
-
-    H = [S[h_i[k - 1] + 1:h_i[k]] for k in range(1, h_i_length)]
 
-    if normalize:
-        C = len(H) / (L / np.log2(L))
-    else:
-        C = len(H)
-
-    gs = gs[1:]
-
-    return C, H, gs
+    # The eigenfunction search is done by the linear-time suffix automaton
+    # engine; H and gs are only built here because this signature returns them.
+    S = np.array(S, dtype=bool)
+    return lz76_complexity(S, type, bool(normalize), return_history=True, return_eigenfunction=True)
 
 
 
@@ -0,0 +1,195 @@
+
+# out = CopBET_DCC_entropy(in,keepdata,parallel)
+#
+# Copenhagen Brain Entropy Toolbox: Dynamic conditional correlation entropy
+# Evaluates the entropy of time-resolved functional connectivity as in
+# Barrett et al., 2020. Every regional time series is fitted with a
+# univariate GARCH(1,1) model, and every pair of regions with a bivariate
+# DCC(1,1) model (Engle, 2002) on the standardised GARCH residuals. The
+# entropy of each edge is the Shannon entropy (nats) of the histogram of
+# its conditional correlation time series, binned as MATLAB's histcounts
+# does by default (Scott's rule bin width rounded to 1, 2, 3, 5 or 10 times
+# a power of ten, over the range of the series).
+#
+# The GARCH models are fitted once per region and reused for all edges, and
+# the DCC models of many edges are fitted together in vectorised batches
+# (shards) that are spread over the worker processes.
+#
+# Input:
+#   in: a matrix (nxp,n>1) or a table where the first column contains
+#   matrices (in cells), e.g., different subjects or scan sessions.
+# name-value pairs:
+#   keepdata: Indicates whether the output table also should contain the
+#   input data, i.e., by adding an extra column containing entropy values.
+#   Defaults to true
+#   parallel: Fit the edge shards in a pool of num_workers worker
+#   processes. Defaults to true
+#   num_workers: Number of worker processes. Defaults to 8
+#   n_bins: Number of fixed bins on [-1, 1] of the correlation histograms
+#   instead of the automatic bins of MATLAB. Defaults to none
+#   shard_size: Number of edges fitted together. Defaults to 2000
+#   checkpoint_dir: Folder where the results of every finished shard are
+#   stored, so a killed job resumes where it stopped and a finished session
+#   is not fitted again. Defaults to no checkpoints
+#
+# Output columns (p x p matrices per session, zero on the diagonal):
+#   entropy: DCC entropy of every edge
+#   variance: Variance of the conditional correlations of every edge
+#
+# Neurobiology Research Unit, 2023
+# Please cite McCulloch, Olsen et al., 2023: "Navigating Chaos in
+# Psychedelic Neuroimaging: A Rigorous Empirical Evaluation of the Entropic
+# Brain Hypothesis" if you use CopBET in your studies. Please read the
+# paper to get a notion of our recommendations regarding the use of the
+# specific methodologies in the toolbox.
+
+# Copyright (C) 2023 Anders Stevnhoved Olsen & Drummond E-Wen McCulloch
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+import hashlib
+import os
+import tempfile
+from functools import partial
+
+import numpy as np
+from functions import CopBET_function_init, CopBET_function_output
+from functions.helper_functions.CopBET_run_sessions import CopBET_run_sessions
+from functions.helper_functions.dcc_garch import dcc_fit, garch_fit
+from functions.helper_functions.pipeline_dataset import load_run
+
+# part of the checkpoint folder name, so shards of an earlier estimator are not reused
+_CHECKPOINT_VERSION = 2
+
+
+def CopBET_DCC_entropy(input_data, **kwargs):
+    # Initialize the output
+    out, num_workers, input_data, nru_specific = CopBET_function_init(input_data, **kwargs)
+
+    n_bins = kwargs.get('n_bins')
+    shard_size = kwargs.get('shard_size', 2000)
+    checkpoint_dir = kwargs.get('checkpoint_dir')
+
+    print('Beginning entropy calculations')
+    entropy, variance = [], []
+    sessions = input_data.iloc[:, 0]
+    for ses, item in enumerate(sessions):
+        ts = _load_session(item)
+        shard_dir = os.path.join(checkpoint_dir, _session_key(ts, n_bins, shard_size)) if checkpoint_dir else None
+        H, V = dcc_session(ts, n_bins, shard_size, num_workers, shard_dir)
+        entropy.append(H)
+        variance.append(V)
+        print(f'Done with session {ses + 1} of {len(sessions)}')
+
+    out['entropy'] = entropy
+    out['variance'] = variance
+    return CopBET_function_output(out, input_data, **kwargs)
+
+
+def dcc_session(ts, n_bins=None, shard_size=2000, num_workers=0, shard_dir=None):
+    """
+    DCC entropy and variance (ROI x ROI, zero diagonal) of one time x ROI
+    session. With shard_dir, finished edge shards are stored there and
+    reused.
+    """
+    n_rois = ts.shape[1]
+
+    # Univariate GARCH once per region, shared by all edges of the region
+    _, z = garch_fit(ts - ts.mean(axis=0))
+
+    i, j = np.triu_indices(n_rois, 1)
+    shards = [(start, i[start:start + shard_size], j[start:start + shard_size])
+              for start in range(0, len(i), shard_size)]
+    if shard_dir:
+        os.makedirs(shard_dir, exist_ok=True)
+
+    shard_fun = partial(_fit_shard, z=z, n_bins=n_bins, shard_dir=shard_dir)
+    results = CopBET_run_sessions(shard_fun, shards, num_workers=num_workers, chunksize=1, verbose=False)
+
+    H = np.zeros((n_rois, n_rois))
+    V = np.zeros((n_rois, n_rois))
+    H[i, j] = np.concatenate([r[0] for r in results])
+    V[i, j] = np.concatenate([r[1] for r in results])
+    return H + H.T, V + V.T
+
+
+def _load_session(item):
+    if isinstance(item, str) and item.endswith(('.csv', '.npy')):
+        return load_run(item)
+    if isinstance(item, np.ndarray) and item.ndim == 2:
+        return np.asarray(item, dtype=np.float64)
+    raise ValueError(f"DCC entropy needs time x ROI matrices, got: {type(item)}")
+
+
+def _session_key(ts, n_bins, shard_size):
+    h = hashlib.sha256(np.ascontiguousarray(ts, dtype=np.float64).tobytes())
+    h.update(f'{ts.shape}_{n_bins}_{shard_size}_v{_CHECKPOINT_VERSION}'.encode())
+    return h.hexdigest()
+
+
+def _fit_shard(shard, rng, z, n_bins, shard_dir):
+    start, i, j = shard
+    path = os.path.join(shard_dir, f'edges_{start}.npz') if shard_dir else None
+    if path and os.path.exists(path):
+        with np.load(path) as f:
+            return f['entropy'], f['variance']
+
+    _, rho = dcc_fit(z[:, i], z[:, j])
+    entropy = _auto_histogram_entropy(rho) if n_bins is None else _histogram_entropy(rho, n_bins)
+    variance = rho.var(axis=0, ddof=1)
+
+    if path:
+        # written atomically, a killed job never leaves a truncated shard behind
+        fd, tmp = tempfile.mkstemp(dir=shard_dir, suffix='.npz.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, entropy=entropy, variance=variance)
+        os.replace(tmp, path)
+    return entropy, variance
+
+
+def _histogram_entropy(rho, n_bins):
+    # Shannon entropy of the histogram of every column, all columns at once
+    T, n = rho.shape
+    bins = np.clip(((rho + 1) / 2 * n_bins).astype(np.intp), 0, n_bins - 1)
+    return _bin_entropy(bins, np.full(n, n_bins))
+
+
+def _auto_histogram_entropy(rho):
+    # Shannon entropy of every column binned like MATLAB's histcounts(x) (binpicker with Scott's rule), all columns
+    # at once; every column gets its own bin width and left edge
+    T, n = rho.shape
+    xmin, xmax = rho.min(axis=0), rho.max(axis=0)
+    xscale = np.maximum(np.abs(xmin), np.abs(xmax))
+    raw_width = np.maximum(3.5 * rho.std(axis=0, ddof=1) / T ** (1 / 3), np.spacing(xscale))
+    power = 10.0 ** np.floor(np.log10(raw_width))
+    relative = raw_width / power
+    width = power * np.select([relative < 1.5, relative < 2.5, relative < 4, relative < 7.5], [1, 2, 3, 5], 10)
+    left = np.minimum(width * np.floor(xmin / width), xmin)
+    n_bins = np.maximum(1, np.ceil((xmax - left) / width)).astype(np.intp)
+    # (nearly) constant series get a single bin
+    constant = xmax - xmin <= np.sqrt(np.spacing(xscale))
+    n_bins[constant] = 1
+    bins = np.clip(np.floor((rho - left) / width), 0, n_bins - 1).astype(np.intp)
+    return _bin_entropy(bins, n_bins)
+
+
+def _bin_entropy(bins, n_bins):
+    # bins: T x n bin indices, n_bins: bins of every column  ->  entropy of every column
+    T, n = bins.shape
+    offsets = np.concatenate([[0], np.cumsum(n_bins)[:-1]])
+    counts = np.bincount((bins + offsets).ravel(), minlength=n_bins.sum())
+    p = counts / T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(p > 0, -p * np.log(p), 0)
+    return np.bincount(np.repeat(np.arange(n), n_bins), weights=terms, minlength=n)
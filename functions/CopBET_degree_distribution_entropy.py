@@ -0,0 +1,121 @@
+
+# out = CopBET_degree_distribution_entropy(in,keepdata,parallel)
+#
+# Copenhagen Brain Entropy Toolbox: Degree distribution entropy
+# Evaluates the Shannon entropy of the degree distribution of functional
+# connectivity graphs as in Viol et al., 2017. The Pearson correlation
+# matrix of every session is thresholded so that the binary graph has a
+# given mean degree, and the entropy of the distribution of node degrees is
+# computed. This is repeated for the integer mean degrees 1 to 100.
+#
+# The correlation matrix is computed and its edges sorted once per session;
+# the graphs of increasing mean degree are then built by adding the next
+# strongest edges to the degrees of the previous graph, in a single pass.
+#
+# Input:
+#   in: a matrix (nxp,n>1) or a table where the first column contains
+#   matrices (in cells), e.g., different subjects or scan sessions.
+# name-value pairs:
+#   keepdata: Indicates whether the output table also should contain the
+#   input data, i.e., by adding an extra column containing entropy values.
+#   Defaults to true
+#   parallel: Process sessions in a pool of num_workers worker processes.
+#   Defaults to true
+#   num_workers: Number of worker processes. Defaults to 8
+#   degrees: Mean degrees at which the entropy is evaluated. Defaults to
+#   1:100. Mean degrees above p-1 (complete graph) give NaN
+#   absolute: Rank edges by absolute correlation. Defaults to false
+#   cache, cache_bytes, cache_dir, atlas: Cache of the sorted correlation
+#   edges, shared with the other graph measures (see
+#   CopBET_time_series_complexity). Defaults to an in-memory cache
+#
+# Output: entropy holds a 1 x numel(degrees) vector per session.
+#
+# Neurobiology Research Unit, 2023
+# Please cite McCulloch, Olsen et al., 2023: "Navigating Chaos in
+# Psychedelic Neuroimaging: A Rigorous Empirical Evaluation of the Entropic
+# Brain Hypothesis" if you use CopBET in your studies. Please read the
+# paper to get a notion of our recommendations regarding the use of the
+# specific methodologies in the toolbox.
+
+# Copyright (C) 2023 Anders Stevnhoved Olsen & Drummond E-Wen McCulloch
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from functools import partial
+
+import numpy as np
+from functions import CopBET_function_init, CopBET_function_output
+from functions.helper_functions.CopBET_run_sessions import CopBET_run_sessions
+from functions.helper_functions.correlation_graph import edge_count, sorted_edges
+from functions.helper_functions.intermediate_cache import cache_params, data_key, session_cache
+from functions.helper_functions.pipeline_dataset import load_run
+
+
+def CopBET_degree_distribution_entropy(input_data, **kwargs):
+    # Initialize the output
+    out, num_workers, input_data, nru_specific = CopBET_function_init(input_data, **kwargs)
+
+    degrees = np.arange(1, 101) if kwargs.get('degrees') is None else np.asarray(kwargs['degrees'])
+    print('Beginning entropy calculations')
+
+    session_fun = partial(_session_entropy, degrees=degrees, absolute=kwargs.get('absolute', False),
+                          cache_params=cache_params(kwargs))
+    results = CopBET_run_sessions(session_fun, input_data.iloc[:, 0], num_workers=num_workers,
+                                  chunksize=kwargs.get('chunksize'))
+
+    out['entropy'] = results
+    return CopBET_function_output(out, input_data, **kwargs)
+
+
+def _load_session(item):
+    if isinstance(item, str) and item.endswith(('.csv', '.npy')):
+        return load_run(item)
+    if isinstance(item, np.ndarray) and item.ndim == 2:
+        return item
+    raise ValueError(f"Degree distribution entropy needs time x ROI matrices, got: {type(item)}")
+
+
+def _session_entropy(item, rng, degrees, absolute=False, cache_params=None):
+    ts = _load_session(item)
+    cache = session_cache({'cache': False} if cache_params is None else cache_params)
+    if cache is None:
+        C, i, j = sorted_edges(ts, absolute)
+    else:
+        # shared with the other graph measures and CopBET_entropy_batch
+        key = [data_key(ts), cache_params.get('atlas')]
+        C, i, j = cache.get([key, ('edges', absolute)], lambda: sorted_edges(ts, absolute))
+    return degree_distribution_entropy(i, j, C.shape[0], degrees)
+
+
+def degree_distribution_entropy(i, j, n_rois, degrees):
+    """
+    Degree distribution entropy at each mean degree, from edges sorted
+    strongest first (see sorted_edges). Degrees must be increasing.
+    """
+    counts = edge_count(n_rois, degrees)
+    entropy = np.full((1, len(degrees)), np.nan)
+    node_degree = np.zeros(n_rois, dtype=np.intp)
+    added = 0
+    for d, n_edges in enumerate(counts):
+        if n_edges > len(i):
+            break
+        # only the edges between the previous and this threshold are new
+        node_degree += np.bincount(i[added:n_edges], minlength=n_rois)
+        node_degree += np.bincount(j[added:n_edges], minlength=n_rois)
+        added = n_edges
+        p = np.bincount(node_degree) / n_rois
+        p = p[p > 0]
+        entropy[0, d] = np.sum(p * np.log2(1 / p))
+    return entropy
@@ -0,0 +1,127 @@
+
+# out = CopBET_entropy_batch(in,measures,keepdata,parallel)
+#
+# Copenhagen Brain Entropy Toolbox: All measures in one pass over the data
+# Computes several CopBET entropy measures for every session while loading
+# each session only once. Intermediates that several measures need (Hilbert
+# envelope and its binarisation, correlation matrix and sorted edges) are
+# computed once per session and shared. This replaces running the measures
+# of Leiden_Call_Entropy_Functions.m one after another, each reloading and
+# re-preprocessing all sessions.
+#
+# Input:
+#   in: a matrix (nxp,n>1) or a table where the first column contains
+#   time x region matrices (or pipeline_data .csv/.npy paths), e.g.,
+#   different subjects or scan sessions.
+#   measures: list of measure names (see MEASURES in
+#   helper_functions/measure_registry.py):
+#       'LZc'        -> entropy_LZc (time series complexity, LZtype)
+#       'metastate'  -> entropy_metastate (metastate series complexity)
+#       'degree'     -> entropy_degree (degree distribution entropy, 1x100)
+#       'pl'         -> entropy_pl (geodesic entropy, 1x100)
+#       'dcc'        -> dcc_entropy, dcc_var (DCC entropy, p x p)
+#       'sampen_roi' -> entropy_sampen_roi (multiscale sample entropy of
+#                        the region time series, scale x p; not the region
+#                        average of voxelwise sample entropy that
+#                        CopBET_sample_entropy computes from volumes)
+# name-value pairs:
+#   keepdata, parallel, num_workers, chunksize, seed: as in
+#   CopBET_time_series_complexity. Sessions are spread over the workers
+#   precision: 'double' or 'single' floating point for the Hilbert
+#   envelopes. Defaults to 'double'
+#   cache: Keep the intermediates in an in-memory LRU cache (see
+#   helper_functions/intermediate_cache.py) so reruns and parameter sweeps
+#   reuse them. Defaults to true
+#   cache_bytes: Memory budget of the cache. Defaults to 256 MB
+#   cache_dir: Folder where intermediates are also stored as .npy files and
+#   memory-mapped from, shared by all processes. Defaults to none
+#   atlas: Atlas name, part of the cache key. Defaults to none
+#   All other name-value pairs are passed on to the measures, e.g. LZtype,
+#   n_surrogates, degrees, absolute, k, replicates, centroid_file, n_bins,
+#   checkpoint_dir, m, r, scales
+#
+# Neurobiology Research Unit, 2023
+# Please cite McCulloch, Olsen et al., 2023: "Navigating Chaos in
+# Psychedelic Neuroimaging: A Rigorous Empirical Evaluation of the Entropic
+# Brain Hypothesis" if you use CopBET in your studies. Please read the
+# paper to get a notion of our recommendations regarding the use of the
+# specific methodologies in the toolbox.
+
+# Copyright (C) 2023 Anders Stevnhoved Olsen & Drummond E-Wen McCulloch
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from functions import CopBET_function_init, CopBET_function_output
+from functions.CopBET_metastate_series_complexity import CopBET_metastate_series_complexity
+from functions.helper_functions.CopBET_run_sessions import CopBET_run_sessions
+from functions.helper_functions.intermediate_cache import data_key, session_cache
+from functions.helper_functions.measure_registry import MEASURES, SessionIntermediates
+from functions.helper_functions.pipeline_dataset import load_run
+
+
+def CopBET_entropy_batch(input_data, measures, **kwargs):
+    # Initialize the output
+    out, num_workers, input_data, nru_specific = CopBET_function_init(input_data, **kwargs)
+
+    unknown = [m for m in measures if m not in MEASURES]
+    if unknown:
+        raise ValueError(f"Unknown measure(s): {', '.join(unknown)}. Available options: {', '.join(MEASURES)}")
+
+    print('Beginning entropy calculations')
+    print(f"Running {', '.join(measures)}")
+
+    # Every session is loaded once and all per-session measures run on it
+    session_measures = tuple(m for m in measures if MEASURES[m].session_fun is not None)
+    need_data = 'metastate' in measures  # metastates are clustered over all sessions afterwards
+    dtype = np.float32 if kwargs.get('precision', 'double') == 'single' else np.float64
+    session_fun = partial(_run_session, measures=session_measures, params=kwargs, dtype=dtype, need_data=need_data)
+    results = CopBET_run_sessions(session_fun, input_data.iloc[:, 0],
+                                  num_workers=num_workers,
+                                  chunksize=kwargs.get('chunksize'),
+                                  seed=kwargs.get('seed'))
+
+    for measure in session_measures:
+        for column in MEASURES[measure].columns:
+            out[column] = [r[column] for r in results]
+
+    if need_data:
+        params = {k: v for k, v in kwargs.items() if k not in ('keep_data', 'keepdata')}
+        metastates = CopBET_metastate_series_complexity(pd.DataFrame({'data': [r['data'] for r in results]}),
+                                                        keep_data=False, **params)
+        out['entropy_metastate'] = metastates['entropy'].to_numpy()
+        out.attrs['centroids'] = metastates.attrs['centroids']
+    return CopBET_function_output(out, input_data, **kwargs)
+
+
+def _load_session(item, dtype):
+    if isinstance(item, str) and item.endswith(('.csv', '.npy')):
+        return load_run(item, dtype)
+    if isinstance(item, np.ndarray) and item.ndim == 2:
+        return item
+    raise ValueError(f"The batch runner needs time x ROI matrices, got: {type(item)}")
+
+
+def _run_session(item, rng, measures, params, dtype, need_data):
+    ts = _load_session(item, dtype)
+    inter = SessionIntermediates(ts, dtype, session_cache(params), [data_key(ts), params.get('atlas')])
+    result = {}
+    for measure in measures:
+        result.update(MEASURES[measure].session_fun(inter, rng, params))
+    if need_data:
+        result['data'] = inter.ts
+    return result
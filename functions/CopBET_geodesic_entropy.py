@@ -0,0 +1,193 @@
+
+# out = CopBET_geodesic_entropy(in,keepdata,parallel)
+#
+# Copenhagen Brain Entropy Toolbox: Geodesic entropy
+# Evaluates the entropy of the distribution of shortest path lengths as in
+# Viol et al., 2019. The Pearson correlation matrix of every session is
+# thresholded so that the binary graph has a given mean degree. As in the
+# MATLAB toolbox, the thresholded matrix keeps its diagonal, so every node
+# counts itself: mean degree k keeps the k*p strongest entries, i.e. the
+# diagonal and (k-1)*p/2 edges. Mean degree 1 is the empty graph (NaN) and
+# mean degrees of p and above keep every edge. For every node, the
+# distribution of geodesic distances (number of edges on the shortest path)
+# to all nodes it can reach is computed, and the geodesic entropy is the
+# Shannon entropy (nats) of that distribution averaged over the nodes that
+# reach at least one other node. This is repeated for the integer mean
+# degrees 1 to 100.
+#
+# The edges are sorted once per session and the graphs of increasing mean
+# degree are grown from the previous one. Sparse graphs are searched with
+# scipy.sparse.csgraph; denser ones with a breadth-first search from all
+# nodes at once (one matrix product per distance), which only needs a few
+# steps because their diameter is small.
+#
+# Input:
+#   in: a matrix (nxp,n>1) or a table where the first column contains
+#   matrices (in cells), e.g., different subjects or scan sessions.
+# name-value pairs:
+#   keepdata: Indicates whether the output table also should contain the
+#   input data, i.e., by adding an extra column containing entropy values.
+#   Defaults to true
+#   parallel: Process sessions in a pool of num_workers worker processes.
+#   Defaults to true
+#   num_workers: Number of worker processes. Defaults to 8
+#   degrees: Mean degrees at which the entropy is evaluated. Defaults to
+#   1:100
+#   absolute: Rank edges by absolute correlation, as the MATLAB toolbox
+#   does. Defaults to true
+#   cache, cache_bytes, cache_dir, atlas: Cache of the sorted correlation
+#   edges, shared with the other graph measures (see
+#   CopBET_time_series_complexity). Defaults to an in-memory cache
+#
+# Output: entropy holds a 1 x numel(degrees) vector per session.
+#
+# Neurobiology Research Unit, 2023
+# Please cite McCulloch, Olsen et al., 2023: "Navigating Chaos in
+# Psychedelic Neuroimaging: A Rigorous Empirical Evaluation of the Entropic
+# Brain Hypothesis" if you use CopBET in your studies. Please read the
+# paper to get a notion of our recommendations regarding the use of the
+# specific methodologies in the toolbox.
+
+# Copyright (C) 2023 Anders Stevnhoved Olsen & Drummond E-Wen McCulloch
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from functools import partial
+
+import numpy as np
+import scipy.sparse
+from scipy.sparse import csgraph
+from functions import CopBET_function_init, CopBET_function_output
+from functions.helper_functions.CopBET_run_sessions import CopBET_run_sessions
+from functions.helper_functions.correlation_graph import sorted_edges
+from functions.helper_functions.intermediate_cache import cache_params, data_key, session_cache
+from functions.helper_functions.pipeline_dataset import load_run
+
+# Below this mean degree the graph is searched with csgraph, above it with
+# the all-nodes breadth-first search
+_SPARSE_DEGREE = 12
+
+
+def CopBET_geodesic_entropy(input_data, **kwargs):
+    # Initialize the output
+    out, num_workers, input_data, nru_specific = CopBET_function_init(input_data, **kwargs)
+
+    degrees = np.arange(1, 101) if kwargs.get('degrees') is None else np.asarray(kwargs['degrees'])
+    print('Beginning entropy calculations')
+
+    session_fun = partial(_session_entropy, degrees=degrees, absolute=kwargs.get('absolute', True),
+                          cache_params=cache_params(kwargs))
+    results = CopBET_run_sessions(session_fun, input_data.iloc[:, 0], num_workers=num_workers,
+                                  chunksize=kwargs.get('chunksize'))
+
+    out['entropy'] = results
+    return CopBET_function_output(out, input_data, **kwargs)
+
+
+def _load_session(item):
+    if isinstance(item, str) and item.endswith(('.csv', '.npy')):
+        return load_run(item)
+    if isinstance(item, np.ndarray) and item.ndim == 2:
+        return item
+    raise ValueError(f"Geodesic entropy needs time x ROI matrices, got: {type(item)}")
+
+
+def _session_entropy(item, rng, degrees, absolute=True, cache_params=None):
+    ts = _load_session(item)
+    cache = session_cache({'cache': False} if cache_params is None else cache_params)
+    if cache is None:
+        C, i, j = sorted_edges(ts, absolute)
+    else:
+        # shared with the other graph measures and CopBET_entropy_batch
+        key = [data_key(ts), cache_params.get('atlas')]
+        C, i, j = cache.get([key, ('edges', absolute)], lambda: sorted_edges(ts, absolute))
+    return geodesic_entropy(i, j, C.shape[0], degrees)
+
+
+def geodesic_entropy(i, j, n_rois, degrees):
+    """
+    Geodesic entropy at each mean degree, from edges sorted strongest first
+    (see sorted_edges). Degrees must be increasing.
+    """
+    counts = edge_counts(n_rois, degrees)
+    entropy = np.full((1, len(degrees)), np.nan)
+    A = np.zeros((n_rois, n_rois), dtype=np.float32)
+    added = 0
+    for d, n_edges in enumerate(counts):
+        if d > 0 and n_edges == added:
+            # same graph as the previous degree, e.g. every degree from p on
+            entropy[0, d] = entropy[0, d - 1]
+            continue
+        # the graph of this mean degree is the previous one plus the next edges
+        A[i[added:n_edges], j[added:n_edges]] = 1
+        A[j[added:n_edges], i[added:n_edges]] = 1
+        added = n_edges
+
+        if degrees[d] < _SPARSE_DEGREE:
+            level_counts = _distance_counts_sparse(A)
+        else:
+            level_counts = _distance_counts_dense(A)
+        entropy[0, d] = _mean_node_entropy(level_counts)
+    return entropy
+
+
+def edge_counts(n_rois, degrees):
+    """
+    Number of edges kept at each mean degree. The diagonal is part of the
+    thresholded matrix, so mean degree k keeps k * n_rois entries: the
+    n_rois diagonal entries and (k - 1) * n_rois / 2 edges, rounded up
+    because both entries of the last edge are kept.
+    """
+    counts = np.ceil((np.asarray(degrees, dtype=np.float64) - 1) * n_rois / 2)
+    return np.clip(counts, 0, n_rois * (n_rois - 1) // 2).astype(np.intp)
+
+
+def _distance_counts_sparse(A):
+    # node x distance counts of the reachable nodes (distance 0, the node itself, left out)
+    D = csgraph.shortest_path(scipy.sparse.csr_matrix(A), method='D', directed=False, unweighted=True)
+    reachable = np.isfinite(D) & (D > 0)
+    rows = np.nonzero(reachable)[0]
+    dist = D[reachable].astype(np.intp)
+    n_levels = dist.max() + 1 if dist.size else 1
+    return np.bincount(rows * n_levels + dist, minlength=A.shape[0] * n_levels).reshape(A.shape[0], n_levels)
+
+
+def _distance_counts_dense(A):
+    # breadth-first search from all nodes at once: the frontier at distance l
+    # is every node adjacent to the frontier at l-1 that was not visited yet
+    # (distance 1 is the adjacency matrix itself)
+    frontier = A
+    visited = (A > 0) | np.eye(A.shape[0], dtype=bool)
+    level_counts = [np.zeros(A.shape[0], dtype=np.intp), (A > 0).sum(axis=1)]
+    while True:
+        frontier = (frontier @ A > 0) & ~visited
+        n_new = frontier.sum(axis=1)
+        if not n_new.any():
+            break
+        visited |= frontier
+        level_counts.append(n_new)
+        frontier = frontier.astype(np.float32)
+    return np.column_stack(level_counts)
+
+
+def _mean_node_entropy(level_counts):
+    # nodes that reach no other node have no distance distribution and are left out
+    total = level_counts.sum(axis=1)
+    reaches = total > 0
+    if not reaches.any():
+        return np.nan
+    p = level_counts[reaches] / total[reaches, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        node_entropy = -np.sum(np.where(p > 0, p * np.log(p), 0), axis=1)
+    return node_entropy.mean()
@@ -0,0 +1,138 @@
+
+# out = CopBET_metastate_series_complexity(in,keepdata,parallel)
+#
+# Copenhagen Brain Entropy Toolbox: Metastate series complexity
+# Evaluates the complexity of the sequence of brain metastates as in
+# Singleton et al., 2022. The time series of all sessions are concatenated
+# and every time point is clustered into one of k=4 metastates using
+# k-means with correlation distance (50 replicates). The Lempel-Ziv (LZ76,
+# exhaustive) complexity of each session's metastate sequence is then
+# compared with that of a randomly permuted version of it. As in the MATLAB
+# outputs, the entropy is C_rand / C, the permuted over the actual
+# complexity, so temporally structured sequences give values above 1.
+#
+# Input:
+#   in: a matrix (nxp,n>1) or a table where the first column contains
+#   matrices (in cells) to be concatenated before clustering, e.g.,
+#   different subjects or scan sessions.
+# name-value pairs:
+#   keepdata: Indicates whether the output table also should contain the
+#   input data, i.e., by adding an extra column containing entropy values.
+#   Defaults to true
+#   parallel: Run the k-means replicates and the sessions in a pool of
+#   num_workers worker processes. Defaults to true
+#   num_workers: Number of worker processes. Defaults to 8
+#   k: Number of metastates. Defaults to 4
+#   distance: k-means distance, 'correlation' or 'sqeuclidean'. Defaults
+#   to 'correlation'
+#   replicates: Number of k-means restarts. Defaults to 50
+#   max_iter: Maximum number of k-means iterations. Defaults to 1000
+#   batch_size: Use mini-batch k-means updates with this many time points
+#   before the final full iterations. Defaults to full batches
+#   centroids: Fitted k x p centroids; the sessions are only assigned to
+#   them instead of being clustered
+#   centroid_file: .npz file holding the centroids. If it exists (and
+#   matches k, p and distance) it is used like centroids, otherwise the
+#   clustering result is stored there, so re-running on new sessions does
+#   not re-cluster
+#   seed: Seed for the k-means starts and the random permutations, which
+#   get independent streams spawned from it
+#   n_surrogates: Number of permuted metastate sequences whose mean LZ
+#   score is divided by that of the actual sequence. Defaults to 1
+#
+# The fitted centroids are returned in out.attrs['centroids'].
+#
+# Neurobiology Research Unit, 2023
+# Please cite McCulloch, Olsen et al., 2023: "Navigating Chaos in
+# Psychedelic Neuroimaging: A Rigorous Empirical Evaluation of the Entropic
+# Brain Hypothesis" if you use CopBET in your studies. Please read the
+# paper to get a notion of our recommendations regarding the use of the
+# specific methodologies in the toolbox.
+
+# Copyright (C) 2023 Anders Stevnhoved Olsen & Drummond E-Wen McCulloch
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from functools import partial
+
+import numpy as np
+from functions import CopBET_function_init, CopBET_function_output
+from functions.helper_functions.CopBET_run_sessions import CopBET_run_sessions
+from functions.helper_functions.lz76_complexity import lz76_complexity
+from functions.helper_functions.metastate_kmeans import (load_centroids, metastate_assign, metastate_kmeans,
+                                                         save_centroids)
+from functions.helper_functions.pipeline_dataset import load_run
+
+
+def CopBET_metastate_series_complexity(input_data, **kwargs):
+    # Initialize the output
+    out, num_workers, input_data, nru_specific = CopBET_function_init(input_data, **kwargs)
+
+    k = kwargs.get('k', 4)
+    distance = kwargs.get('distance', 'correlation')
+
+    # All sessions (time x ROI) are clustered together
+    data = [_load_session(item) for item in input_data.iloc[:, 0]]
+    if len({d.shape[1] for d in data}) > 1:
+        raise ValueError('All sessions must have the same number of regions to be clustered together')
+    X = np.concatenate(data, axis=0)
+    print('Beginning entropy calculations')
+
+    # independent streams for the k-means starts and the per-session permutations
+    cluster_seed, session_seed = np.random.SeedSequence(kwargs.get('seed')).spawn(2)
+
+    centroids = kwargs.get('centroids')
+    if centroids is None:
+        centroids = load_centroids(kwargs.get('centroid_file'), k, X.shape[1], distance)
+    if centroids is None:
+        print(f'Clustering {X.shape[0]} time points into {k} metastates')
+        labels, centroids, _ = metastate_kmeans(X, k, distance,
+                                                n_replicates=kwargs.get('replicates', 50),
+                                                max_iter=kwargs.get('max_iter', 1000),
+                                                batch_size=kwargs.get('batch_size'),
+                                                num_workers=num_workers,
+                                                seed=cluster_seed)
+        if kwargs.get('centroid_file'):
+            save_centroids(kwargs['centroid_file'], centroids, distance)
+    else:
+        print('Using stored metastate centroids')
+        labels = metastate_assign(X, np.asarray(centroids, dtype=np.float64), distance)
+
+    # Metastate sequence of every session
+    splits = np.cumsum([d.shape[0] for d in data])[:-1]
+    sequences = np.split(labels, splits)
+
+    session_fun = partial(_session_complexity, n_surrogates=kwargs.get('n_surrogates', 1))
+    results = CopBET_run_sessions(session_fun, sequences, num_workers=num_workers,
+                                  chunksize=kwargs.get('chunksize'), seed=session_seed)
+    entropy, C_rand_mean = np.array(results, dtype=float).reshape(-1, 2).T
+
+    out['entropy'] = entropy
+    out['C_rand_mean'] = C_rand_mean
+    out.attrs['centroids'] = centroids
+    return CopBET_function_output(out, input_data, **kwargs)
+
+
+def _load_session(item):
+    if isinstance(item, str) and item.endswith(('.csv', '.npy')):
+        return load_run(item)
+    if isinstance(item, np.ndarray) and item.ndim == 2:
+        return item
+    raise ValueError(f"Metastate series complexity needs time x ROI matrices, got: {type(item)}")
+
+
+def _session_complexity(states, rng, n_surrogates=1):
+    C = lz76_complexity(states, 'exhaustive')
+    C_rand = np.mean([lz76_complexity(rng.permutation(states), 'exhaustive') for _ in range(n_surrogates)])
+    return C_rand / C, C_rand
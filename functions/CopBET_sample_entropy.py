@@ -0,0 +1,138 @@
+
+# out = CopBET_sample_entropy(in,atlas,keepdata,parallel)
+#
+# Copenhagen Brain Entropy Toolbox: Sample entropy
+# Evaluates multiscale sample entropy as in Lebedev et al., 2016. The
+# sample entropy (m=2, r=0.3 standard deviations) of every voxel time
+# series is computed at the coarse-graining scales 1 to 5 and averaged
+# within every region of the atlas.
+#
+# Templates are matched for many voxels at once (all template pairs at the
+# same lag are compared in one vectorised step), the scales share one
+# cumulative sum of the data, and the voxels are split into chunks that are
+# spread over the worker processes.
+#
+# Input:
+#   in: a table where the first column contains 4D volumes (NIfTI paths or
+#   arrays, e.g. 'denoised_volumes'), or time x ROI matrices, in which
+#   case every column is one region and atlas is not used.
+#   atlas: 3D label array, atlas name in Atlases/ (e.g. 'yeo17') or path
+#   to an atlas NIfTI. Voxels with label 0 are left out
+# name-value pairs:
+#   keepdata: Indicates whether the output table also should contain the
+#   input data, i.e., by adding an extra column containing entropy values.
+#   Defaults to true
+#   parallel: Process voxel chunks in a pool of num_workers worker
+#   processes. Defaults to true
+#   num_workers: Number of worker processes. Defaults to 8
+#   m: Template length. Defaults to 2
+#   r: Tolerance as a fraction of the standard deviation. Defaults to 0.3
+#   scales: Coarse-graining scales. Defaults to 1:5
+#   chunk_size: Voxels per chunk. Defaults to 4096
+#   nifti_cache_dir: Where .nii.gz inputs are decompressed once so they can
+#   be memory-mapped. Defaults to a folder in the system temp directory
+#
+# Output: entropy holds a scale x ROI matrix per session. Voxels without
+# matching templates (infinite or undefined sample entropy) are left out of
+# the region averages.
+#
+# Neurobiology Research Unit, 2023
+# Please cite McCulloch, Olsen et al., 2023: "Navigating Chaos in
+# Psychedelic Neuroimaging: A Rigorous Empirical Evaluation of the Entropic
+# Brain Hypothesis" if you use CopBET in your studies. Please read the
+# paper to get a notion of our recommendations regarding the use of the
+# specific methodologies in the toolbox.
+
+# Copyright (C) 2023 Anders Stevnhoved Olsen & Drummond E-Wen McCulloch
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+from functools import partial
+
+import nibabel as nib
+import numpy as np
+from functions import CopBET_function_init, CopBET_function_output
+from functions.helper_functions.CopBET_run_sessions import CopBET_run_sessions
+from functions.helper_functions.atlas_parcellation import atlas_path
+from functions.helper_functions.load_nifti_data import load_nifti_data
+from functions.helper_functions.pipeline_dataset import load_run
+from functions.helper_functions.sample_entropy import multiscale_sample_entropy
+
+
+def CopBET_sample_entropy(input_data, atlas=None, **kwargs):
+    # Initialize the output
+    out, num_workers, input_data, nru_specific = CopBET_function_init(input_data, **kwargs)
+
+    scales = list(kwargs.get('scales', range(1, 6)))
+    chunk_size = kwargs.get('chunk_size', 4096)
+    mse = partial(_chunk_entropy, m=kwargs.get('m', 2), r=kwargs.get('r', 0.3), scales=scales)
+
+    labels = None
+    if atlas is not None:
+        labels = np.rint(np.asanyarray(nib.load(atlas_path(atlas)).dataobj) if isinstance(atlas, str)
+                         else np.asarray(atlas)).astype(np.int64)
+        roi_labels = np.unique(labels[labels > 0])
+
+    print('Beginning entropy calculations')
+    entropy = []
+    sessions = input_data.iloc[:, 0]
+    for ses, item in enumerate(sessions):
+        ts, voxel_labels = _load_session(item, labels, kwargs.get('nifti_cache_dir'))
+
+        # voxel chunks are independent, so they go to the worker processes
+        chunks = [ts[:, start:start + chunk_size] for start in range(0, ts.shape[1], chunk_size)]
+        sampen = np.concatenate(CopBET_run_sessions(mse, chunks, num_workers=num_workers, chunksize=1,
+                                                    verbose=False), axis=1)
+
+        if voxel_labels is None:
+            entropy.append(sampen)
+        else:
+            entropy.append(_roi_means(sampen, voxel_labels, roi_labels))
+        print(f'Done with session {ses + 1} of {len(sessions)}')
+
+    out['entropy'] = entropy
+    return CopBET_function_output(out, input_data, **kwargs)
+
+
+def _load_session(item, labels, nifti_cache_dir):
+    # time x voxel (or ROI) matrix and the atlas label of every column
+    if isinstance(item, str) and item.endswith(('.csv', '.npy')):
+        return load_run(item), None
+    if isinstance(item, np.ndarray) and item.ndim == 2:
+        return item, None
+    if labels is None:
+        raise ValueError('Sample entropy of volumes needs an atlas')
+    mask = labels > 0
+    if isinstance(item, str) and item.endswith(('.nii', '.nii.gz')):
+        return load_nifti_data(item, mask=mask, cache_dir=nifti_cache_dir), labels[mask]
+    if isinstance(item, np.ndarray) and item.ndim == 4:
+        return item[mask].T, labels[mask]
+    raise ValueError(f"Unsupported input data type: {type(item)}")
+
+
+def _chunk_entropy(chunk, rng, m, r, scales):
+    return multiscale_sample_entropy(chunk, m, r, scales, chunk_size=chunk.shape[1])
+
+
+def _roi_means(sampen, voxel_labels, roi_labels):
+    # mean over the voxels of every region, leaving out non-finite values
+    finite = np.isfinite(sampen)
+    rows = np.searchsorted(roi_labels, voxel_labels)
+    sums = np.zeros((sampen.shape[0], len(roi_labels)))
+    counts = np.zeros((sampen.shape[0], len(roi_labels)))
+    for s in range(sampen.shape[0]):
+        sums[s] = np.bincount(rows, weights=np.where(finite[s], sampen[s], 0), minlength=len(roi_labels))
+        counts[s] = np.bincount(rows, weights=finite[s], minlength=len(roi_labels))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sums / counts
@@ -20,6 +20,36 @@
 #   keepdata: Indicates whether the output table also should contain the
 #   input data, i.e., by adding an extra column containing entropy values.
 #   Defaults to true
+#   or 'reference' to keep the input data without copying it: the results
+#   are joined to the input table by index and its arrays are returned as
+#   read-only views, so peak memory stays at about one copy of the input
+#   parallel: Process sessions in a pool of num_workers worker processes.
+#   Defaults to true
+#   num_workers: Number of worker processes. Defaults to 8
+#   chunksize: Number of sessions sent to a worker at a time. Defaults to
+#   about four chunks per worker
+#   seed: Seed for the random permutations. Each session gets its own
+#   generator, so results do not depend on the number of workers
+#   precision: 'double' or 'single' floating point for the Hilbert
+#   envelopes. Defaults to 'double'
+#   n_surrogates: Number of permuted versions of the data whose mean LZ
+#   score normalises the output. Their mean and standard deviation are
+#   returned in C_rand_mean and C_rand_sd. Defaults to 1
+#   mask: Brain mask or atlas (boolean array or NIfTI path) restricting
+#   NIfTI inputs to the voxels inside it. Defaults to all voxels
+#   nifti_cache_dir: Where .nii.gz inputs are decompressed once so they can
+#   be memory-mapped. Defaults to a folder in the system temp directory
+#   cache: Keep the binarised envelopes in an in-memory LRU cache (see
+#   helper_functions/intermediate_cache.py), so reruns with other LZtypes or
+#   surrogate settings reuse them. Defaults to true
+#   cache_bytes: Memory budget of the cache. Defaults to 256 MB
+#   cache_dir: Folder where the envelopes are also stored as .npy files and
+#   memory-mapped from, shared by all processes. Defaults to none
+#   atlas: Atlas name, part of the cache key. Defaults to none
+#
+# For more sessions than fit in memory, CopBET_time_series_complexity_stream
+# takes an iterator of (metadata, data) records and yields the result rows
+# as the sessions finish, optionally appending them to a CSV file.
 #
 # Neurobiology Research Unit, 2023
 # Please cite McCulloch, Olsen et al., 2023: "Navigating Chaos in
@@ -45,100 +75,204 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see http://www.gnu.org/licenses/.
 
-import numpy as np
-from scipy.signal import hilbert
-import nibabel as nib
-import pandas as pd
-from functions import CopBET_function_init
-
-def load_nifti_data(file_path):
-    nifti_img = nib.load(file_path)
-    data = nifti_img.get_fdata()
-    return data
+import contextlib
+import csv
+from functools import partial
 
+import numpy as np
+from functions import CopBET_function_init, CopBET_function_output
+from functions.helper_functions.CopBET_run_sessions import CopBET_run_sessions, CopBET_stream_sessions
+from functions.helper_functions.hilbert_envelope import hilbert_envelope
+from functions.helper_functions.intermediate_cache import cache_params, data_key, session_cache
+from functions.helper_functions.load_nifti_data import load_nifti_data
+from functions.helper_functions.lz76_complexity import lz76_complexity
+from functions.helper_functions.lz78_complexity import lz78_complexity
+from functions.helper_functions.permutation_surrogates import permutation_surrogates
+from functions.helper_functions.pipeline_dataset import load_run
 
 def CopBET_time_series_complexity(input_data, LZtype, **kwargs):
     # Initialize the output
-    out = CopBET_function_init(input_data, **kwargs)
+    out, num_workers, input_data, nru_specific = CopBET_function_init(input_data, **kwargs)
 
     # Validate LZtype
+    _check_LZtype(LZtype)
+
+    # The first column of the table holds the data (arrays or file paths)
+    sessions = input_data.iloc[:, 0]
+    print('Beginning entropy calculations')
+    print(f'Running {LZtype}')
+
+    # Sessions are independent, so they are farmed out to worker processes
+    # when parallel=True (num_workers=0 runs them here, one after another)
+    session_fun = partial(_session_complexity, LZtype=LZtype, **_session_options(kwargs))
+    results = CopBET_run_sessions(session_fun, sessions,
+                                  num_workers=num_workers,
+                                  chunksize=kwargs.get('chunksize'),
+                                  seed=kwargs.get('seed'))
+    entropy, C_rand_mean, C_rand_sd = np.array(results, dtype=float).reshape(-1, 3).T
+
+    # Update the output with calculated entropy
+    out['entropy'] = entropy
+    out['C_rand_mean'] = C_rand_mean
+    out['C_rand_sd'] = C_rand_sd
+    return CopBET_function_output(out, input_data, **kwargs)
+
+
+def CopBET_time_series_complexity_stream(records, LZtype, sink=None, **kwargs):
+    """
+    Streaming version of CopBET_time_series_complexity for arbitrarily many
+    sessions, e.g. thousands of scans across datasets.
+
+    Sessions are read from the `records` iterator only when a worker is
+    free, so at most `max_pending` of them are resident at once, and a
+    result row is yielded (and appended to `sink`) as soon as its session
+    finishes. Pass file paths instead of arrays to keep even the queued
+    sessions out of memory.
+
+    Args:
+        records (iterable): (metadata dict, data) pairs, where data is an
+            array or a path as in the data column of the table input.
+        LZtype (str): As in CopBET_time_series_complexity.
+        sink (str, optional): CSV file the result rows are appended to. Its
+            columns are those of an existing sink's header, otherwise index,
+            the metadata keys (fieldnames, or those of the first finished
+            session) and the results. A session with metadata keys that are
+            not columns raises a ValueError.
+        **kwargs: The name-value pairs of CopBET_time_series_complexity
+            (parallel, num_workers, seed, precision, n_surrogates, mask,
+            nifti_cache_dir, cache...), max_pending (sessions resident at
+            once, defaults to twice num_workers) and fieldnames (the
+            metadata keys of all sessions, as sink columns).
+
+    Yields:
+        dict: The metadata of a session plus its entropy, C_rand_mean and
+        C_rand_sd, in the order the sessions finish. `index` is the position
+        of the session in records.
+    """
+    _check_LZtype(LZtype)
+    num_workers = kwargs.get('num_workers', 8) if kwargs.get('parallel', True) else 0
+    session_fun = partial(_session_complexity, LZtype=LZtype, **_session_options(kwargs))
+
+    metadata = {}
+
+    def items():
+        # metadata is kept until its session finishes, the data only in the pool
+        for index, (meta, data) in enumerate(records):
+            metadata[index] = meta
+            yield data
+
+    writer = None
+    columns = _sink_header(sink) if sink else None
+    if columns is None and kwargs.get('fieldnames') is not None:
+        columns = ['index', *kwargs['fieldnames'], 'entropy', 'C_rand_mean', 'C_rand_sd']
+    with open(sink, 'a', newline='') if sink else contextlib.nullcontext() as f:
+        for index, (entropy, C_rand_mean, C_rand_sd) in CopBET_stream_sessions(
+                session_fun, items(), num_workers=num_workers, max_pending=kwargs.get('max_pending'),
+                seed=kwargs.get('seed')):
+            row = {'index': index, **metadata.pop(index),
+                   'entropy': entropy, 'C_rand_mean': C_rand_mean, 'C_rand_sd': C_rand_sd}
+            if f is not None:
+                if writer is None:
+                    columns = columns or list(row)
+                    writer = csv.DictWriter(f, fieldnames=columns)
+                    if f.tell() == 0:
+                        writer.writeheader()
+                unknown = [key for key in row if key not in columns]
+                if unknown:
+                    raise ValueError(f"Session {index} has metadata that is not a column of {sink}: "
+                                     f"{', '.join(unknown)}. Pass all metadata keys as fieldnames")
+                writer.writerow(row)
+                f.flush()
+            yield row
+
+
+def _sink_header(sink):
+    # columns of a sink that already has rows, which new rows are appended under
+    try:
+        with open(sink, newline='') as f:
+            return next(csv.reader(f), None)
+    except FileNotFoundError:
+        return None
+
+
+def _check_LZtype(LZtype):
     valid_types = ['LZ78temporal', 'LZ78spatial', 'LZ76temporal', 'LZ76spatial']
     if LZtype not in valid_types:
         raise ValueError("Please specify which type of time-series complexity measure to use. "
                          "Possible inputs are 'LZ78temporal', 'LZ78spatial', 'LZ76temporal', 'LZ76spatial'")
 
-    
-    # Check if input_data is a DataFrame
-    if isinstance(input_data, pd.DataFrame):
-        print(f"Shape of input_data: {input_data.shape}")
-        print(f"Columns in input_data: {input_data.columns}")
-        print("First few rows of input_data:")
-        print(input_data.head())
-
-    # elif isinstance(input_data, list):
-    #     print(f"Length of input_data list: {len(input_data)}")
-    if isinstance(input_data, pd.DataFrame):
-        if not input_data.empty:
-            print(f"Type of first element in input_data: {type(input_data.iloc[0])}")
-            if hasattr(input_data.iloc[0], 'shape'):
-                print(f"Shape of first element in input_data: {input_data.iloc[0].shape}")
-    else:
-        print("Input_data is not a DataFrame.")
-    # Main loop through the input data
-    for ses, item in enumerate(input_data):
-    # Check if item is a file path (string) and load data accordingly
-        if isinstance(item, str):
-            if item.endswith('.nii.gz'):  # Assuming NIFTI files end with '.nii.gz'
-                ts = load_nifti_data(item)
-            else:
-                print(f"Unsupported file type or path: {item}")
-                continue
-        elif isinstance(item, np.ndarray):
-            ts = item  # Data is already an ndarray, likely loaded from MAT
-        else:
-            print(f"Unsupported input data type: {type(item)}")
-            continue
 
-        # Now, ts contains your time series data, proceed with existing steps
-        abs_hts = np.abs(hilbert(ts))
-        mean_bold = np.mean(abs_hts)
-        bin_abs_hts = (abs_hts > mean_bold).astype(int)
+def _session_options(kwargs):
+    dtype = np.float32 if kwargs.get('precision', 'double') == 'single' else np.float64
+    return dict(dtype=dtype, n_surrogates=kwargs.get('n_surrogates', 1), mask=kwargs.get('mask'),
+                nifti_cache_dir=kwargs.get('nifti_cache_dir'), cache_params=cache_params(kwargs))
 
-        # Create random time series by shuffling each regional time series
-        random_ts = np.empty_like(abs_hts)
-        for roi in range(ts.shape[1]):
-            np.random.shuffle(abs_hts[:, roi])
-            random_ts[:, roi] = abs_hts[:, roi]
 
-        M_rand = (random_ts > mean_bold)
+def _session_complexity(item, rng, LZtype, dtype=np.float64, n_surrogates=1, mask=None, nifti_cache_dir=None,
+                        cache_params=None):
+    dtype = np.dtype(dtype)
+    # NIfTI files are identified by path and modification time, so a cached
+    # binarised envelope is found without reading the volumes
+    nifti = isinstance(item, str) and item.endswith(('.nii', '.nii.gz'))
+    if isinstance(item, str) and not nifti:
+        if item.endswith(('.csv', '.npy')):
+            item = load_run(item, dtype)  # pipeline_data run (time x ROI)
+        else:
+            print(f"Unsupported file type or path: {item}")
+            return np.nan, np.nan, np.nan
+    elif not nifti and not isinstance(item, np.ndarray):
+        print(f"Unsupported input data type: {type(item)}")
+        return np.nan, np.nan, np.nan
+
+    def binarise():
+        if nifti:
+            # Memory-mapped; with a mask only the masked voxels are read (time x voxel)
+            ts = load_nifti_data(item, dtype=dtype, mask=mask, cache_dir=nifti_cache_dir)
+        else:
+            ts = item  # Data is already an ndarray, likely loaded from MAT
 
-        # Perform complexity calculations
-        C = np.empty(ts.shape[1])
-        C_rand = np.empty(ts.shape[1])
+        # Now, ts contains your time series data, proceed with existing steps.
+        # Volumes (x,y,z,t) have time last, ROI tables (t,ROI) have it first;
+        # either way the envelope is taken along time only
+        if ts.ndim > 2:
+            abs_hts = hilbert_envelope(ts, axis=-1, dtype=dtype).reshape(-1, ts.shape[-1]).T
+        else:
+            abs_hts = hilbert_envelope(ts, axis=0, dtype=dtype)
+        return abs_hts > np.mean(abs_hts)
 
-        if LZtype in ['LZ78temporal', 'LZ76temporal']:
-            longts = bin_abs_hts.flatten()
-            C = cpr(longts)  # Placeholder for complexity calculation
-            long_rand = M_rand.flatten()
-            C_rand = cpr(long_rand)  # Placeholder for random complexity calculation
+    cache = session_cache({'cache': False} if cache_params is None else cache_params)
+    if cache is None:
+        bin_abs_hts = binarise()
+    else:
+        key = [data_key(item), cache_params.get('atlas')]
+        if nifti or item.ndim > 2:
+            key.append(None if mask is None else data_key(mask))
+        bin_abs_hts = cache.get([key, ('binary', dtype.name)], binarise)
+    return envelope_complexity(bin_abs_hts, rng, LZtype, n_surrogates)
 
-        elif LZtype in ['LZ78spatial', 'LZ76spatial']:
-            bin_abs_hts = bin_abs_hts.T
-            M_rand = M_rand.T
 
-            longts = bin_abs_hts.flatten()
-            C = cpr(longts)  # Placeholder for complexity calculation
-            long_rand = M_rand.flatten()
-            C_rand = cpr(long_rand)  # Placeholder for random complexity calculation
+def envelope_complexity(bin_abs_hts, rng, LZtype, n_surrogates=1):
+    """
+    Normalised LZ complexity of a binarised (time x region) Hilbert envelope,
+    its surrogate mean and standard deviation.
+    """
+    # Random baseline: every regional time series permuted independently.
+    # Permuting the binarised matrix is the same as binarising permuted
+    # envelopes (the threshold is fixed), and leaves abs_hts untouched
+    M_rand = permutation_surrogates(bin_abs_hts, n_surrogates, rng)
 
-        # Calculate and store the entropy
-        entropy[ses] = np.mean(C / C_rand)
+    if LZtype in ['LZ78spatial', 'LZ76spatial']:
+        bin_abs_hts = bin_abs_hts.T
+        M_rand = M_rand.transpose(0, 2, 1)
 
-        print(f'Done with session {ses + 1} of {len(input_data)}')
+    # Perform complexity calculations
+    lz = lz76_complexity if LZtype in ['LZ76temporal', 'LZ76spatial'] else lz78_complexity
+    C = lz(bin_abs_hts.flatten())
+    C_rand = np.array([lz(M.flatten()) for M in M_rand], dtype=float)
+
+    C_rand_sd = np.std(C_rand, ddof=1) if n_surrogates > 1 else np.nan
+    return C / np.mean(C_rand), np.mean(C_rand), C_rand_sd
 
-    # Update the output with calculated entropy
-    out['entropy'] = entropy
-    return out
 
 def cpr(string):
     """
@@ -226,67 +360,8 @@ def calc_lz_complexity(S, type, normalize):
         raise ValueError("'normalize' must be a scalar")
     if type.lower() not in ['exhaustive', 'primitive']:
         raise ValueError("''type'' parameter is not valid, must be either 'exhaustive' or 'primitive'")
-    
-    S = np.array(S, dtype=bool)
-    normalize = bool(normalize)
-    L = len(S)
-    gs = np.zeros(L + 1, dtype=int)
-    gs[0] = 0
-
-    S_string = binary_seq_to_string(S)
-    gs[1] = 1
-
-    for n in range(1, L):
-        eigenvalue_found = False
-        idx_list = np.arange(gs[n] + 1, n + 1)
-        for k in range(int(np.ceil(len(idx_list) / 2))):
-            m_upper = idx_list[-k - 1]
-            if not S_string[:n].find(S_string[m_upper - 1:n]) >= 0:
-                gs[n + 1] = m_upper
-                eigenvalue_found = True
-                break
-
-            m_lower = idx_list[k]
-            if S_string[:n].find(S_string[m_lower - 1:n]) >= 0:
-                gs[n + 1] = m_lower - 1
-                eigenvalue_found = True
-                break
-            elif m_upper == m_lower + 1:
-                gs[n + 1] = m_lower
-                eigenvalue_found = True
-                break
-
-        if not eigenvalue_found:
-            raise ValueError('Internal error: could not find eigenvalue')
-
-    if type.lower() == 'exhaustive':
-        h_i = np.zeros(len(gs), dtype=int)
-        h_i_length = 1
-        h_prev = 0
-        while True:
-            k = np.argmax(gs[(h_prev + 2):] > h_prev) + 1
-            if k > 0:
-                h_i_length += 1
-                h_prev += k
-                h_i[h_i_length - 1] = h_prev
-            else:
-                break
-    else:
-        _, n = np.unique(gs, return_index=True)
-        h_i_length = len(n)
-        h_i = n - 1
-
-    if h_i[h_i_length - 1] != L:
-        h_i_length += 1
-        h_i[h_i_length - 1] = L
-
-    H = [S[h_i[k - 1] + 1:h_i[k]] for k in range(1, h_i_length)]
 
-    if normalize:
-        C = len(H) / (L / np.log2(L))
-    else:
-        C = len(H)
-
-    gs = gs[1:]
-
-    return C, H, gs
+    # The eigenfunction search is done by the linear-time suffix automaton
+    # engine; H and gs are only built here because this signature returns them.
+    S = np.array(S, dtype=bool)
+    return lz76_complexity(S, type, bool(normalize), return_history=True, return_eigenfunction=True)
@@ -0,0 +1,21 @@
+# CopBET functions, importable from one flat namespace the way MATLAB's
+# addpath(genpath(...)) exposes them, e.g.
+#   from functions import CopBET_time_series_complexity
+from .helper_functions.CopBET_function_init import CopBET_function_init, CopBET_function_output
+from .helper_functions.CopBET_run_sessions import CopBET_run_sessions, CopBET_stream_sessions
+from .helper_functions.duplicate_sessions import find_duplicate_sessions
+from .helper_functions.atlas_parcellation import atlas_matrix, parcellate, write_ROIdata
+from .helper_functions.hilbert_envelope import hilbert_envelope
+from .helper_functions.load_nifti_data import load_nifti_data
+from .helper_functions.lz76_complexity import lz76_complexity
+from .helper_functions.lz78_complexity import lz78_complexity
+from .helper_functions.permutation_surrogates import permutation_surrogates
+from .helper_functions.pipeline_dataset import PipelineDataset, load_run
+from .CopBET_time_series_complexity import (CopBET_time_series_complexity, CopBET_time_series_complexity_stream,
+                                            calc_lz_complexity, cpr)
+from .CopBET_metastate_series_complexity import CopBET_metastate_series_complexity
+from .CopBET_DCC_entropy import CopBET_DCC_entropy
+from .CopBET_degree_distribution_entropy import CopBET_degree_distribution_entropy
+from .CopBET_geodesic_entropy import CopBET_geodesic_entropy
+from .CopBET_sample_entropy import CopBET_sample_entropy
+from .CopBET_entropy_batch import CopBET_entropy_batch
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 def CopBET_function_init(in_data, **kwargs):
@@ -8,7 +9,11 @@ def CopBET_function_init(in_data, **kwargs):
         in_data (pandas.DataFrame, list, or str): Input data. Can be a DataFrame, a 2D matrix-like object (list of lists), or a string.
         **kwargs: Keyword arguments:
             parallel (bool, optional): Enable parallel processing. Defaults to True.
-            keep_data (bool, optional): Retain a copy of input data in the output. Defaults to True.
+            num_workers (int, optional): Number of worker processes when parallel is True. Defaults to 8.
+            keep_data (bool or str, optional): Retain a copy of input data in the output. 'reference' keeps the
+                input data without copying it: the output table starts as an empty results frame, and
+                CopBET_function_output joins it to the input by index, with the data as read-only views.
+                Defaults to True. keepdata is accepted as well.
             nru_specific (bool, optional): Flag for NRU-specific settings. Defaults to False.
 
     Returns:
@@ -19,7 +24,8 @@ def CopBET_function_init(in_data, **kwargs):
     """
 
     parallel = kwargs.get('parallel', True)
-    keep_data = kwargs.get('keep_data', True)
+    num_workers = kwargs.get('num_workers', 8)
+    keep_data = _keep_data(kwargs)
     nru_specific = kwargs.get('nru_specific', False)
 
     # Input Data Handling
@@ -31,10 +37,12 @@ def CopBET_function_init(in_data, **kwargs):
             raise ValueError("Input data must be a DataFrame, a matrix (nxp, n>1), or a string, where the FIRST column of the DataFrame contains the data")
 
     # Parallel Processing Setup
-    num_workers = 8 if parallel else 0
+    num_workers = num_workers if parallel else 0
 
     # Output DataFrame Initialization
-    if keep_data:
+    if keep_data == 'reference':
+        out_data = pd.DataFrame(index=in_data.index)  # results only, joined to the input at the end
+    elif keep_data:
         out_data = in_data.copy()  # Use .copy() to avoid modifying the input
     else:
         out_data = pd.DataFrame()
@@ -44,3 +52,44 @@ def CopBET_function_init(in_data, **kwargs):
         print('Warning: Overwriting entropy column in data table')
 
     return out_data, num_workers, in_data, nru_specific
+
+
+def CopBET_function_output(out_data, in_data, **kwargs):
+    """
+    Final output table of a CopBET function. With keep_data='reference' the
+    results frame is joined to the input table by index. pandas shares the
+    column data between both tables (copy-on-write), and the arrays of the
+    data column are replaced by read-only views, so the input is neither
+    copied nor modifiable through the output. Otherwise out_data is returned
+    unchanged.
+
+    Args:
+        out_data (pandas.DataFrame): The output table from CopBET_function_init, with the results added.
+        in_data (pandas.DataFrame): The input table from CopBET_function_init.
+        **kwargs: The keyword arguments passed to CopBET_function_init.
+
+    Returns:
+        pandas.DataFrame: The output table.
+    """
+    if _keep_data(kwargs) != 'reference':
+        return out_data
+
+    # results replace input columns of the same name, as with a copied table
+    view = in_data.drop(columns=[col for col in out_data.columns if col in in_data.columns])
+    if len(view.columns):
+        first = view.columns[0]
+        view[first] = pd.Series([_read_only(x) for x in view[first]], index=view.index, dtype=object)
+    out = view.join(out_data)
+    out.attrs.update(out_data.attrs)
+    return out
+
+
+def _keep_data(kwargs):
+    return kwargs.get('keep_data', kwargs.get('keepdata', True))
+
+
+def _read_only(x):
+    if isinstance(x, np.ndarray):
+        x = x.view()
+        x.flags.writeable = False
+    return x
@@ -0,0 +1,102 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+import numpy as np
+
+
+def CopBET_run_sessions(session_fun, items, num_workers=0, chunksize=None, seed=None, verbose=True):
+    """
+    Runs a per-session function over all sessions, optionally in a process pool.
+
+    Every session gets its own random generator spawned from `seed`, so the
+    results do not depend on the number of workers or on how sessions are
+    scheduled, and they are always returned in input order.
+
+    Args:
+        session_fun (callable): Picklable function called as
+            session_fun(item, rng), where rng is a numpy.random.Generator.
+        items (iterable): One entry per session, e.g. the data column of a table.
+        num_workers (int, optional): Number of worker processes. 0 runs the
+            sessions serially in this process. Defaults to 0.
+        chunksize (int, optional): Sessions sent to a worker at a time.
+            Defaults to about four chunks per worker.
+        seed (int or numpy.random.SeedSequence, optional): Seed for the
+            per-session generators. Defaults to fresh OS entropy.
+        verbose (bool, optional): Print progress. Defaults to True.
+
+    Returns:
+        list: The output of session_fun for every session, in input order.
+    """
+    items = list(items)
+    n = len(items)
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    seeds = root.spawn(n)
+
+    if num_workers and n > 1:
+        if chunksize is None:
+            chunksize = max(1, n // (4 * num_workers))
+        with ProcessPoolExecutor(max_workers=min(num_workers, n)) as pool:
+            results = []
+            for ses, result in enumerate(pool.map(_run_one, [session_fun] * n, items, seeds, chunksize=chunksize)):
+                results.append(result)
+                if verbose:
+                    print(f'Done with session {ses + 1} of {n}')
+        return results
+
+    results = []
+    for ses, (item, ss) in enumerate(zip(items, seeds)):
+        results.append(_run_one(session_fun, item, ss))
+        if verbose:
+            print(f'Done with session {ses + 1} of {n}')
+    return results
+
+
+def CopBET_stream_sessions(session_fun, items, num_workers=0, max_pending=None, seed=None):
+    """
+    Generator version of CopBET_run_sessions for arbitrarily many sessions.
+
+    Items are taken from the iterable only when there is room for them, so
+    at most `max_pending` sessions are resident (queued or running) at any
+    time, and results are yielded as soon as they finish. Session k gets
+    the same random generator as in CopBET_run_sessions, so the results do
+    not depend on the order in which they finish.
+
+    Args:
+        session_fun (callable): Picklable function called as session_fun(item, rng).
+        items (iterable): One entry per session; may be a lazy generator.
+        num_workers (int, optional): Number of worker processes. 0 runs the
+            sessions serially in this process. Defaults to 0.
+        max_pending (int, optional): Sessions resident at once. Defaults to
+            twice the number of workers.
+        seed (int or numpy.random.SeedSequence, optional): Seed for the
+            per-session generators. Defaults to fresh OS entropy.
+
+    Yields:
+        tuple: (index of the session in items, output of session_fun).
+    """
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    items = enumerate(items)
+
+    if not num_workers:
+        for ses, item in items:
+            yield ses, _run_one(session_fun, item, root.spawn(1)[0])
+        return
+
+    max_pending = max_pending or 2 * num_workers
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        pending = {}
+
+        def submit(n):
+            for ses, item in islice(items, n):
+                pending[pool.submit(_run_one, session_fun, item, root.spawn(1)[0])] = ses
+
+        submit(max_pending)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+            submit(max_pending - len(pending))
+
+
+def _run_one(session_fun, item, seed_seq):
+    return session_fun(item, np.random.default_rng(seed_seq))
@@ -0,0 +1,133 @@
+import glob
+import os
+from functools import lru_cache
+
+import nibabel as nib
+import numpy as np
+import scipy.sparse
+from scipy.io import savemat
+
+from functions.helper_functions.load_nifti_data import load_nifti_data
+
+ATLAS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Atlases'))
+
+
+def atlas_path(atlas):
+    """
+    Resolves an atlas name ('Schaefer1000', 'yeo17', 'AAL90', ...) to its file
+    in Atlases/. Paths to NIfTI files are returned unchanged.
+    """
+    if os.path.isfile(atlas):
+        return os.path.abspath(atlas)
+    candidates = glob.glob(os.path.join(ATLAS_DIR, '*_2mm.nii'))
+    for pattern in (f'{atlas}_2mm.nii', f'{atlas}_'):
+        matches = [f for f in candidates if os.path.basename(f).lower().startswith(pattern.lower())]
+        if matches:
+            return sorted(matches)[0]
+    raise ValueError(f"Atlas not found: {atlas}. Available options: {', '.join(local_atlases())}")
+
+
+def local_atlases():
+    """Names of the atlases in Atlases/ that atlas_path resolves, e.g. ['AAL90', 'CONN_atlas', ...]."""
+    return sorted(os.path.basename(f)[:-len('_2mm.nii')] for f in glob.glob(os.path.join(ATLAS_DIR, '*_2mm.nii')))
+
+
+def atlas_matrix(atlas, labels=None):
+    """
+    Sparse ROI x voxel averaging matrix of an atlas, built once per atlas and
+    label subset and cached for the rest of the session.
+
+    Args:
+        atlas (str): Atlas name or path to an atlas NIfTI.
+        labels (list of int, optional): Only use these labels. Defaults to all
+            non-zero labels.
+
+    Returns:
+        scipy.sparse.csr_matrix: ROI x voxel matrix whose rows average the
+            voxels of one ROI. Columns follow the voxels of `mask` in C order.
+        numpy.ndarray: Boolean 3D mask of the voxels used.
+        numpy.ndarray: The label value of every row.
+        numpy.ndarray: The affine of the atlas.
+    """
+    path = atlas_path(atlas)
+    return _atlas_matrix(path, os.path.getmtime(path), None if labels is None else tuple(labels))
+
+
+@lru_cache(maxsize=16)
+def _atlas_matrix(path, mtime, labels):
+    img = nib.load(path)
+    atlas = np.rint(np.asanyarray(img.dataobj)).astype(np.int64)
+    mask = np.isin(atlas, labels) if labels is not None else atlas > 0
+    voxel_labels = atlas[mask]
+    roi_labels, rows, counts = np.unique(voxel_labels, return_inverse=True, return_counts=True)
+    weights = 1.0 / counts[rows]
+    P = scipy.sparse.csr_matrix((weights, (rows, np.arange(voxel_labels.size))),
+                                shape=(roi_labels.size, voxel_labels.size))
+    for arr in (mask, roi_labels):
+        arr.setflags(write=False)
+    return P, mask, roi_labels, img.affine
+
+
+def parcellate(images, atlas, labels=None, dtype=np.float64, batch_size=8, cache_dir=None):
+    """
+    ROI time series (time x ROI, like V_roi in ROIdata) of 4D images.
+
+    Only the voxels covered by the atlas are read (see load_nifti_data), and
+    the ROI averages of a batch of sessions are formed with a single sparse
+    matrix product against the cached atlas matrix.
+
+    Args:
+        images (str or list of str): 4D NIfTI file(s) on the atlas grid.
+        atlas (str): Atlas name or path to an atlas NIfTI.
+        labels (list of int, optional): Only use these labels.
+        dtype (numpy.dtype, optional): Output dtype. Defaults to np.float64.
+        batch_size (int, optional): Sessions combined into one product. Defaults to 8.
+        cache_dir (str, optional): Passed on to load_nifti_data.
+
+    Returns:
+        numpy.ndarray or list of numpy.ndarray: time x ROI array per image.
+    """
+    single = isinstance(images, (str, os.PathLike))
+    images = [images] if single else list(images)
+    P, mask, roi_labels, affine = atlas_matrix(atlas, labels)
+
+    out = []
+    for start in range(0, len(images), batch_size):
+        batch = []
+        for image in images[start:start + batch_size]:
+            header = nib.load(image)
+            if header.shape[:3] != mask.shape or not np.allclose(header.affine, affine, atol=1e-3):
+                raise ValueError(f"{image} is not on the grid of atlas {atlas}; resample it first")
+            batch.append(load_nifti_data(image, dtype=dtype, mask=mask, cache_dir=cache_dir))
+        # time x voxel blocks stacked over sessions, averaged into ROIs at once
+        roi_ts = np.asarray((P @ np.concatenate(batch, axis=0).T).T, dtype=dtype)
+        splits = np.cumsum([ts.shape[0] for ts in batch])[:-1]
+        out.extend(np.split(roi_ts, splits, axis=0))
+    return out[0] if single else out
+
+
+def write_ROIdata(tbl, atlas, topfolder, **kwargs):
+    """
+    Regenerates ROIdata/<atlas>/*.mat (variable V_roi, time x ROI) for a
+    CopBET_CarhartHarris_2016_data table loaded with 'denoised_volumes'.
+
+    Args:
+        tbl (pandas.DataFrame): Table with data (NIfTI paths), subject,
+            condition and session columns.
+        atlas (str): Atlas name or path to an atlas NIfTI.
+        topfolder (str): The LSDdata (or LSDdata/exampledata) folder.
+        **kwargs: Passed on to parcellate.
+
+    Returns:
+        list of str: The files written.
+    """
+    atlas_name = os.path.basename(atlas).split('_2mm')[0] if os.path.isfile(atlas) else atlas
+    out_folder = os.path.join(topfolder, 'ROIdata', atlas_name)
+    os.makedirs(out_folder, exist_ok=True)
+
+    written = []
+    for (_, row), V_roi in zip(tbl.iterrows(), parcellate(list(tbl['data']), atlas, **kwargs)):
+        file_path = os.path.join(out_folder, f"{row['subject']}_{row['condition']}_task-rest_run-0{row['session']}_bold.mat")
+        savemat(file_path, {'V_roi': V_roi})
+        written.append(file_path)
+    return written
@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def sorted_edges(ts, absolute=False):
+    """
+    Edges of the correlation graph of a session, strongest first.
+
+    The Pearson correlation matrix is computed once and its upper triangle is
+    sorted once, so the graph at any mean degree is simply the first
+    edge_count(...) edges of the returned lists.
+
+    Args:
+        ts (numpy.ndarray): time x ROI matrix.
+        absolute (bool, optional): Rank edges by |r| instead of r. Defaults to False.
+
+    Returns:
+        numpy.ndarray: Correlation matrix (ROI x ROI).
+        numpy.ndarray: First node of every edge, strongest edge first.
+        numpy.ndarray: Second node of every edge.
+    """
+    C = np.corrcoef(np.asarray(ts, dtype=np.float64), rowvar=False)
+    i, j = np.triu_indices(C.shape[0], 1)
+    w = C[i, j]
+    if absolute:
+        w = np.abs(w)
+    order = np.argsort(-w, kind='stable')
+    return C, i[order], j[order]
+
+
+def edge_count(n_rois, mean_degree):
+    """Number of edges of a graph with n_rois nodes and the given mean degree (2 * edges / nodes)."""
+    return np.rint(np.asarray(mean_degree) * n_rois / 2).astype(np.intp)
@@ -0,0 +1,199 @@
+import numpy as np
+
+# Starting grid of the (a, b) searches. GARCH and DCC persistence is usually
+# high (a small, a + b close to 1), so the grid is densest there.
+_A_GRID = np.array([0.0, 0.01, 0.03, 0.06, 0.1, 0.2, 0.35])
+_B_GRID = np.array([0.0, 0.3, 0.6, 0.8, 0.9, 0.95, 0.98])
+_MAX_PERSISTENCE = 0.999
+# Smallest DCC a. MATLAB's constrained optimiser stops just inside a >= 0
+# (its conditional correlation variances are about 1e-12 where the
+# likelihood is best at a = 0), so its correlations are never exactly
+# constant and their histograms have the spread of the scaled
+# innovations rather than a single bin.
+_MIN_DCC_A = 1e-6
+
+
+def garch_fit(eps):
+    """
+    GARCH(1,1) fits of all columns of eps at once.
+
+    h_t = w + a * eps_{t-1}^2 + b * h_{t-1}, with variance targeting
+    (w = (1 - a - b) * var(eps)), so only a and b are estimated by maximum
+    likelihood, for all series in the same vectorised search.
+
+    Args:
+        eps (numpy.ndarray): time x series matrix of zero-mean residuals.
+
+    Returns:
+        numpy.ndarray: The a and b of every series (series x 2).
+        numpy.ndarray: time x series standardised residuals eps / sqrt(h).
+    """
+    eps = np.asarray(eps, dtype=np.float64)
+    e2 = eps ** 2
+    var = e2.mean(axis=0)
+
+    def nll(a, b, rows):
+        return _garch_nll(e2[:, rows], var[rows], a, b)
+
+    a, b = _fit_ab(nll, eps.shape[1])
+    h = _garch_variance(e2, var, a, b)
+    return np.column_stack((a, b)), eps / np.sqrt(h)
+
+
+def dcc_fit(z1, z2):
+    """
+    Bivariate DCC(1,1) fits (Engle, 2002) of many pairs of standardised
+    residual series at once.
+
+    Q_t = (1 - a - b) * Qbar + a * z_{t-1} z_{t-1}' + b * Q_{t-1}, and the
+    conditional correlation is rho_t = q12_t / sqrt(q11_t * q22_t). a and b
+    of every pair maximise the second stage DCC likelihood, with a of at
+    least 1e-6 as in MATLAB.
+
+    Args:
+        z1, z2 (numpy.ndarray): time x pair matrices of the two series of each pair.
+
+    Returns:
+        numpy.ndarray: The a and b of every pair (pair x 2).
+        numpy.ndarray: time x pair conditional correlations rho_t.
+    """
+    z1 = np.asarray(z1, dtype=np.float64)
+    z2 = np.asarray(z2, dtype=np.float64)
+    moments = (z1 * z1, z2 * z2, z1 * z2)
+
+    def nll(a, b, rows):
+        return _dcc_recursion(tuple(m[:, rows] for m in moments), a, b, want_rho=False)
+
+    a, b = _fit_ab(nll, z1.shape[1], a_min=_MIN_DCC_A)
+    rho = _dcc_recursion(moments, a[:, None], b[:, None], want_rho=True)[..., 0]
+    return np.column_stack((a, b)), rho
+
+
+def _garch_variance(e2, var, a, b):
+    # e2: T x n, var: n, a/b: n or n x c  ->  h: T x n (x c)
+    extra = (slice(None),) + (None,) * (np.ndim(a) - 1)
+    w = (1 - a - b) * var[extra]
+    h = np.empty((e2.shape[0],) + np.shape(a))
+    h[0] = var[extra]
+    for t in range(1, e2.shape[0]):
+        h[t] = w + a * e2[t - 1][extra] + b * h[t - 1]
+    return h
+
+
+def _garch_nll(e2, var, a, b):
+    h = _garch_variance(e2, var, a, b)
+    return 0.5 * (np.log(h) + e2[..., None] / h).sum(axis=0)
+
+
+def _dcc_recursion(moments, a, b, want_rho):
+    # moments: three T x n arrays, a/b: n x c  ->  rho (T x n x c) or the negative log likelihood (n x c).
+    # The likelihood is summed on the fly, so the search never holds T x n x c arrays
+    z11, z22, z12 = moments
+    q11_bar, q22_bar, q12_bar = (m.mean(axis=0)[:, None] for m in moments)
+    c = 1 - a - b
+    q11, q22, q12 = (np.broadcast_to(q, a.shape).copy() for q in (q11_bar, q22_bar, q12_bar))
+    rho = np.empty((z11.shape[0],) + a.shape) if want_rho else None
+    nll = np.zeros(a.shape)
+    for t in range(z11.shape[0]):
+        if t:
+            q11 = c * q11_bar + a * z11[t - 1][:, None] + b * q11
+            q22 = c * q22_bar + a * z22[t - 1][:, None] + b * q22
+            q12 = c * q12_bar + a * z12[t - 1][:, None] + b * q12
+        r = q12 / np.sqrt(q11 * q22)
+        if want_rho:
+            rho[t] = r
+        else:
+            one_minus = np.maximum(1 - r ** 2, 1e-12)
+            nll += np.log(one_minus) + (z11[t][:, None] + z22[t][:, None] - 2 * r * z12[t][:, None]) / one_minus
+    # the z'z term of the likelihood does not depend on a and b and is left out
+    return rho if want_rho else 0.5 * nll
+
+
+def _fit_ab(nll, n, tol=1e-6, max_iter=500, a_min=0.0):
+    """
+    Minimises nll(a, b, rows) (a, b: len(rows) x c candidates -> len(rows) x c
+    values) for n independent problems at once under a >= a_min, b >= 0 and
+    a + b < 1. A grid search gives every problem's start, then a pattern search over
+    the 8 neighbours moves to the best one and doubles its steps while
+    that improves the likelihood, halves them when it does not, and stops
+    once both steps are below tol. Only problems that have not converged are
+    evaluated.
+    """
+    A, B = np.meshgrid(np.maximum(_A_GRID, a_min), _B_GRID)
+    keep = A + B < _MAX_PERSISTENCE
+    a = np.broadcast_to(A[keep], (n, keep.sum()))
+    b = np.broadcast_to(B[keep], (n, keep.sum()))
+    best_a, best_b, best_f = _best(nll, a, b, np.arange(n))
+
+    step = np.tile([0.02, 0.05], (n, 1))
+    offsets = np.array([-1, 0, 1])
+    da, db = (d.ravel() for d in np.meshgrid(offsets, offsets))
+    da, db = da[(da != 0) | (db != 0)], db[(da != 0) | (db != 0)]  # the centre is the current best
+    active = np.arange(n)
+    for _ in range(max_iter):
+        if not active.size:
+            break
+        a = best_a[active, None] + step[active, :1] * da
+        b = best_b[active, None] + step[active, 1:] * db
+        a, b = np.clip(a, a_min, _MAX_PERSISTENCE), np.clip(b, 0, _MAX_PERSISTENCE)
+        over = a + b >= _MAX_PERSISTENCE
+        b = np.maximum(np.where(over, _MAX_PERSISTENCE - 1e-6 - a, b), 0)
+        cand_a, cand_b, cand_f = _best(nll, a, b, active)
+        better = cand_f < best_f[active]
+        moved, stuck = active[better], active[~better]
+        best_a[moved], best_b[moved], best_f[moved] = cand_a[better], cand_b[better], cand_f[better]
+        step[moved] = np.minimum(step[moved] * 2, 0.5)
+        step[stuck] /= 2
+        active = active[step[active].max(axis=1) >= tol]
+    return _newton_polish(nll, best_a, best_b, best_f, a_min=a_min)
+
+
+def _newton_polish(nll, a, b, f, h=1e-4, rounds=10, a_min=0.0):
+    """
+    Newton steps from the pattern search results, with gradient and Hessian
+    from central differences on a 3 x 3 stencil and a backtracking line
+    search. The pattern search only moves along the axes and diagonals, so
+    it creeps along the narrow ridges (a traded against b at similar a + b)
+    that strongly persistent series give; the Newton step follows them.
+    Problems whose stencil leaves the feasible region keep their point.
+    """
+    offsets = np.array([-1, 0, 1])
+    da, db = (d.ravel() for d in np.meshgrid(offsets, offsets))
+    shrink = 0.5 ** np.arange(6)
+    active = np.arange(len(a))
+    for _ in range(rounds):
+        if not active.size:
+            break
+        sa, sb = a[active, None] + h * da, b[active, None] + h * db
+        feasible = (sa.min(axis=1) >= a_min) & (sb.min(axis=1) >= 0) & ((sa + sb).max(axis=1) < _MAX_PERSISTENCE)
+        active, sa, sb = active[feasible], sa[feasible], sb[feasible]
+        if not active.size:
+            break
+        F = nll(sa, sb, active).reshape(-1, 3, 3)  # F[:, j, i] at (a + i h, b + j h) offsets
+        g = np.stack(((F[:, 1, 2] - F[:, 1, 0]) / (2 * h), (F[:, 2, 1] - F[:, 0, 1]) / (2 * h)), axis=1)
+        haa = (F[:, 1, 2] - 2 * F[:, 1, 1] + F[:, 1, 0]) / h ** 2
+        hbb = (F[:, 2, 1] - 2 * F[:, 1, 1] + F[:, 0, 1]) / h ** 2
+        hab = (F[:, 2, 2] - F[:, 2, 0] - F[:, 0, 2] + F[:, 0, 0]) / (4 * h ** 2)
+        det = haa * hbb - hab ** 2
+        convex = (haa > 0) & (det > 0) & np.isfinite(det)
+        det = np.where(convex, det, 1)
+        step_a = np.where(convex, -(hbb * g[:, 0] - hab * g[:, 1]) / det, 0)
+        step_b = np.where(convex, -(haa * g[:, 1] - hab * g[:, 0]) / det, 0)
+
+        ca = np.clip(a[active, None] + shrink * step_a[:, None], a_min, _MAX_PERSISTENCE)
+        cb = np.clip(b[active, None] + shrink * step_b[:, None], 0, _MAX_PERSISTENCE)
+        cb = np.maximum(np.where(ca + cb >= _MAX_PERSISTENCE, _MAX_PERSISTENCE - 1e-6 - ca, cb), 0)
+        cand_a, cand_b, cand_f = _best(nll, ca, cb, active)
+        better = cand_f < f[active]
+        moved = active[better]
+        a[moved], b[moved], f[moved] = cand_a[better], cand_b[better], cand_f[better]
+        active = moved[np.hypot(step_a, step_b)[better] >= 1e-9]
+    return a, b
+
+
+def _best(nll, a, b, rows):
+    f = nll(a, b, rows)
+    f = np.where(np.isfinite(f), f, np.inf)
+    i = f.argmin(axis=1)
+    idx = np.arange(len(i))
+    return a[idx, i].copy(), b[idx, i].copy(), f[idx, i]
@@ -0,0 +1,63 @@
+import itertools
+from collections import defaultdict
+
+import numpy as np
+
+
+def find_duplicate_sessions(arrays, tol=1, n_projections=4, n_hashed=2, seed=0):
+    """
+    Pairs of sessions that are (nearly) the same data: same shape and a
+    Frobenius norm of the difference below tol.
+
+    Comparing all pairs costs O(n^2) difference matrices. Instead, every
+    session is reduced to a few random projections onto unit vectors, which
+    differ by at most the Frobenius norm of the difference, so sessions
+    whose projections are tol or more apart cannot be duplicates. The first
+    n_hashed projections are quantised into cells of width tol and hashed;
+    only sessions in the same or neighbouring cells are candidates, the
+    remaining projections prune them further and the survivors get an exact
+    comparison. The result is the same as the pairwise check, in linear time
+    for data without duplicates.
+
+    Args:
+        arrays (sequence of numpy.ndarray): The sessions, e.g. time x ROI matrices.
+        tol (float, optional): Sessions closer than this are duplicates. Defaults to 1.
+        n_projections (int, optional): Number of random projections per session. Defaults to 4.
+        n_hashed (int, optional): Number of projections used as hash key. Defaults to 2.
+        seed (int, optional): Seed for the projection vectors. Defaults to 0.
+
+    Returns:
+        list: Sorted (h, h2) index pairs with h < h2.
+    """
+    rng = np.random.default_rng(seed)
+    n_hashed = min(n_hashed, n_projections)
+
+    groups = defaultdict(list)
+    for h, a in enumerate(arrays):
+        groups[np.shape(a)].append(h)
+
+    pairs = []
+    offsets = list(itertools.product((-1, 0, 1), repeat=n_hashed))
+    for shape, members in groups.items():
+        if len(members) < 2:
+            continue
+        R = rng.standard_normal((int(np.prod(shape)), n_projections))
+        R /= np.linalg.norm(R, axis=0)
+        proj = np.stack([np.asarray(arrays[h], dtype=np.float64).ravel() @ R for h in members])
+
+        cells = defaultdict(list)
+        for row, h in enumerate(members):
+            # non-finite data never compares as equal, as in the pairwise check
+            if not np.all(np.isfinite(proj[row])):
+                continue
+            cell = tuple(np.floor(proj[row, :n_hashed] / tol).astype(np.int64))
+            for offset in offsets:
+                for row2 in cells.get(tuple(c + o for c, o in zip(cell, offset)), ()):
+                    if np.all(np.abs(proj[row] - proj[row2]) < tol) and _close(arrays[members[row2]], arrays[h], tol):
+                        pairs.append((members[row2], h))
+            cells[cell].append(row)
+    return sorted(pairs)
+
+
+def _close(a, b, tol):
+    return np.linalg.norm(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)) < tol
@@ -0,0 +1,79 @@
+from functools import lru_cache
+
+import numpy as np
+import scipy.fft
+
+
+def hilbert_envelope(ts, axis=0, dtype=np.float64, chunk_size=None, workers=None):
+    """
+    Amplitude of the analytic signal (abs(hilbert(ts))) along the time axis.
+
+    Uses real FFTs only: the Hilbert transform is obtained as the inverse rfft
+    of the spectrum rotated by -90 degrees, and the envelope as
+    sqrt(ts**2 + hilbert_transform**2). The series are processed in chunks so
+    that the temporary spectra never hold more than about 64 MB, and the
+    spectral multiplier is cached per (number of volumes, dtype) so it is
+    shared by all sessions of the same length (scipy.fft keeps the matching
+    FFT plans in its own cache).
+
+    Args:
+        ts (numpy.ndarray): Time series, e.g. time x ROI or x*y*z x time.
+        axis (int, optional): The time axis. Defaults to 0.
+        dtype (numpy.dtype, optional): np.float64 or np.float32. Defaults to np.float64.
+        chunk_size (int, optional): Number of series transformed at a time.
+            Defaults to what fits in 64 MB of complex spectra.
+        workers (int, optional): Threads used by scipy.fft. Defaults to 1.
+
+    Returns:
+        numpy.ndarray: The envelope, same shape as ts, of the requested dtype.
+    """
+    dtype = np.dtype(dtype)
+    ts = np.asarray(ts)
+    axis = axis % ts.ndim
+    n = ts.shape[axis]
+
+    # Flatten to 2D with time along the first or last axis without copying
+    if axis == 0:
+        x = ts.reshape(n, -1)
+    elif axis == ts.ndim - 1:
+        x = ts.reshape(-1, n)
+    else:
+        x = np.moveaxis(ts, axis, -1).reshape(-1, n)
+    time_last = axis != 0
+    n_series = x.shape[0] if time_last else x.shape[1]
+
+    if chunk_size is None:
+        bytes_per_series = (n // 2 + 1) * 2 * dtype.itemsize + n * dtype.itemsize
+        chunk_size = max(1, (64 * 2**20) // bytes_per_series)
+
+    mult = _hilbert_multiplier(n, dtype.str)
+    env = np.empty(x.shape, dtype=dtype)
+    for start in range(0, n_series, chunk_size):
+        idx = (slice(start, start + chunk_size), slice(None)) if time_last else (slice(None), slice(start, start + chunk_size))
+        chunk = x[idx].astype(dtype, copy=False)
+        if time_last:
+            spec = scipy.fft.rfft(chunk, axis=1, workers=workers)
+            spec *= mult
+            ht = scipy.fft.irfft(spec, n=n, axis=1, workers=workers)
+        else:
+            spec = scipy.fft.rfft(chunk, axis=0, workers=workers)
+            spec *= mult[:, None]
+            ht = scipy.fft.irfft(spec, n=n, axis=0, workers=workers)
+        np.hypot(chunk, ht, out=env[idx])
+
+    if axis == 0 or axis == ts.ndim - 1:
+        return env.reshape(ts.shape)
+    return np.moveaxis(env.reshape(np.moveaxis(ts, axis, -1).shape), -1, axis)
+
+
+@lru_cache(maxsize=32)
+def _hilbert_multiplier(n, dtype_str):
+    # -1j on the positive frequencies, 0 on DC and (for even n) Nyquist,
+    # which is what scipy.signal.hilbert puts into the imaginary part
+    complex_dtype = np.result_type(np.dtype(dtype_str), np.complex64)
+    mult = np.full(n // 2 + 1, -1j, dtype=complex_dtype)
+    mult[0] = 0
+    if n % 2 == 0:
+        mult[-1] = 0
+    mult.setflags(write=False)
+    return mult
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 256 << 20
+
+
+class IntermediateCache:
+    """
+    Two-level cache for per-session intermediates (Hilbert envelopes,
+    binarised series, correlation matrices, sorted edges).
+
+    Entries are keyed by a hash of the session data, the atlas and the
+    preprocessing parameters. The first level is an in-process LRU holding
+    at most `max_bytes` of arrays; the optional second level stores every
+    entry as .npy file(s) in `cache_dir`, which are memory-mapped when read
+    back, so other processes and later sessions reuse them too.
+
+    Args:
+        max_bytes (int, optional): Memory budget of the first level. Defaults to 256 MB.
+        cache_dir (str, optional): Folder of the on-disk level. Defaults to none.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key_parts, fun):
+        """The cached value for key_parts, computed with fun() on a miss."""
+        key = cache_key(key_parts)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        value = self._load(key)
+        if value is None:
+            value = fun()
+            self._store(key, value)
+        self._remember(key, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def _remember(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = value
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= _nbytes(old)
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        path = os.path.join(self.cache_dir, key)
+        if os.path.isfile(path + '.npy'):
+            return np.load(path + '.npy', mmap_mode='r')
+        if os.path.isdir(path):
+            n = len([f for f in os.listdir(path) if f.endswith('.npy')])
+            return tuple(np.load(os.path.join(path, f'{k}.npy'), mmap_mode='r') for k in range(n))
+        return None
+
+    def _store(self, key, value):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # written to a temporary name first, readers never see a partial entry
+        if isinstance(value, tuple):
+            tmp = tempfile.mkdtemp(dir=self.cache_dir, suffix='.tmp')
+            for k, arr in enumerate(value):
+                np.save(os.path.join(tmp, f'{k}.npy'), np.asarray(arr))
+            try:
+                os.rename(tmp, os.path.join(self.cache_dir, key))
+            except OSError:  # another process stored it first
+                shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.npy.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(value))
+            os.replace(tmp, os.path.join(self.cache_dir, key + '.npy'))
+
+
+def cache_key(key_parts):
+    return hashlib.sha256(json.dumps(key_parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def data_key(data):
+    """
+    Hash identifying session data: the contents of an array, or the path,
+    size and modification time of a file.
+    """
+    if isinstance(data, (str, os.PathLike)):
+        stat = os.stat(data)
+        return cache_key([os.path.abspath(data), stat.st_size, stat.st_mtime_ns])
+    data = np.ascontiguousarray(data)
+    h = hashlib.blake2b(data.view(np.uint8).ravel(), digest_size=20)
+    h.update(f'{data.dtype.str}{data.shape}'.encode())
+    return h.hexdigest()
+
+
+_caches = {}
+
+
+def get_intermediate_cache(max_bytes=DEFAULT_MAX_BYTES, cache_dir=None):
+    """
+    The cache of this process for a given on-disk folder, created on first
+    use. Repeated calls (e.g. reruns in a notebook, or the sessions handled
+    by one worker process) share it.
+    """
+    cache = _caches.get(cache_dir)
+    if cache is None:
+        cache = _caches[cache_dir] = IntermediateCache(max_bytes, cache_dir)
+    cache.max_bytes = max_bytes
+    return cache
+
+
+def session_cache(params):
+    """
+    The cache selected by the name-value pairs of a CopBET function: cache
+    (default true), cache_bytes and cache_dir. None when caching is off.
+    """
+    if not params.get('cache', True):
+        return None
+    return get_intermediate_cache(params.get('cache_bytes', DEFAULT_MAX_BYTES), params.get('cache_dir'))
+
+
+def cache_params(kwargs):
+    """The cache name-value pairs of kwargs, to be passed on to worker processes."""
+    return {k: kwargs[k] for k in ('cache', 'cache_bytes', 'cache_dir', 'atlas') if k in kwargs}
+
+
+def _nbytes(value):
+    if isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    # memory-mapped entries hardly use memory, they only count their header
+    return 0 if isinstance(value, np.memmap) else getattr(value, 'nbytes', 0)
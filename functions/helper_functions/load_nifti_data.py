@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+
+import nibabel as nib
+import numpy as np
+
+
+def load_nifti_data(file_path, dtype=np.float64, mask=None, labels=None, cache_dir=None, time_chunk=16):
+    """
+    Loads the data of a (4D) NIfTI file without decompressing or upcasting
+    more than needed.
+
+    Uncompressed .nii files are memory-mapped. A .nii.gz file is decompressed
+    once into `cache_dir` (see nifti_uncompressed_path) and the uncompressed
+    copy is memory-mapped from then on. With a mask, only the voxels inside
+    it are read, a few volumes at a time, so the full 4D array is never held
+    in memory.
+
+    Args:
+        file_path (str): Path to a .nii or .nii.gz file.
+        dtype (numpy.dtype, optional): Output dtype. Defaults to np.float64.
+            None returns the memory-mapped array in its on-disk dtype
+            (only without mask and without scaling).
+        mask (numpy.ndarray or str, optional): Boolean 3D mask, or path to a
+            mask/atlas NIfTI whose non-zero voxels are used.
+        labels (list of int, optional): Only use the voxels of these atlas
+            labels in `mask`.
+        cache_dir (str, optional): Where decompressed copies are kept.
+        time_chunk (int, optional): Volumes read at a time when masking.
+            Defaults to 16.
+
+    Returns:
+        numpy.ndarray: The x*y*z*t data, or a time x voxel matrix when a
+        mask is given.
+    """
+    img = nib.load(nifti_uncompressed_path(file_path, cache_dir), mmap=True)
+    raw = img.dataobj.get_unscaled()
+    slope, inter = img.dataobj.slope, img.dataobj.inter
+    scaled = not (slope == 1 and inter == 0)
+
+    if mask is None and dtype is None and not scaled:
+        return raw
+    if dtype is None:
+        dtype = np.float64
+
+    if mask is None:
+        data = np.asarray(raw, dtype=dtype)
+        if scaled:
+            data = data * slope + inter
+        return data
+
+    voxels = nifti_mask(mask, labels)
+    if voxels.shape != raw.shape[:3]:
+        raise ValueError(f"Mask of shape {voxels.shape} does not match data of shape {raw.shape}")
+    n_vols = raw.shape[3] if raw.ndim > 3 else 1
+    raw = raw.reshape(raw.shape[:3] + (n_vols,), order='A')
+    out = np.empty((n_vols, int(voxels.sum())), dtype=dtype)
+    # Volumes are contiguous on disk (NIfTI is Fortran ordered), so reading
+    # a few whole volumes at a time touches every page only once
+    for t0 in range(0, n_vols, time_chunk):
+        out[t0:t0 + time_chunk] = raw[..., t0:t0 + time_chunk][voxels].T
+    if scaled:
+        out *= slope
+        out += inter
+    return out
+
+
+def nifti_mask(mask, labels=None):
+    """
+    Boolean 3D mask from an array or a mask/atlas NIfTI file, optionally
+    restricted to a subset of atlas labels.
+    """
+    if isinstance(mask, (str, os.PathLike)):
+        mask = np.asanyarray(nib.load(mask).dataobj)
+    mask = np.asarray(mask)
+    if labels is not None:
+        return np.isin(mask, labels)
+    return mask != 0
+
+
+def nifti_uncompressed_path(file_path, cache_dir=None):
+    """
+    Path to an uncompressed, memory-mappable copy of a NIfTI file.
+
+    .nii files are returned as they are. A .nii.gz file is decompressed into
+    `cache_dir` (default: CopBET_nifti_cache in the system temp directory)
+    the first time it is requested and again only if the source is newer
+    than the cached copy.
+    """
+    file_path = os.path.abspath(file_path)
+    if not file_path.endswith('.gz'):
+        return file_path
+
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), 'CopBET_nifti_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    # Same file names in different subject folders must not collide
+    tag = hashlib.sha1(file_path.encode()).hexdigest()[:12]
+    cached = os.path.join(cache_dir, f"{tag}_{os.path.basename(file_path)[:-3]}")
+
+    if not os.path.exists(cached) or os.path.getmtime(cached) < os.path.getmtime(file_path):
+        # Write under a temporary name first so that concurrent workers never
+        # map a half-written file
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.nii')
+        with os.fdopen(fd, 'wb') as dst, gzip.open(file_path, 'rb') as src:
+            shutil.copyfileobj(src, dst, 16 * 2**20)
+        os.replace(tmp, cached)
+    return cached
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+def lz78_complexity(bits, length=None):
+    """
+    Dictionary size of the Lempel-Ziv-Welch parse of a binary sequence.
+
+    Gives the same count as `cpr`, but works directly on NumPy arrays: the
+    dictionary is a binary trie stored in a flat integer list, so a phrase is
+    extended by following one child index instead of concatenating strings.
+
+    Args:
+        bits (numpy.ndarray): Binary sequence as a bool/0-1 array, or a
+            `numpy.packbits` byte array when `length` is given.
+        length (int, optional): Number of symbols in a packed `bits` array.
+
+    Returns:
+        int: Number of words in the dictionary.
+    """
+    bits = np.asarray(bits)
+    if length is not None:
+        bits = np.unpackbits(bits.astype(np.uint8, copy=False).ravel(), count=length)
+    seq = (bits.ravel() != 0).view(np.uint8).tobytes()
+    n = len(seq)
+    if n == 0:
+        return 0
+
+    # child[2*node + symbol] holds 2*child_node. The two single-symbol nodes
+    # exist from the start but are stored negated until they are added to
+    # the dictionary, which only happens for the very first symbol.
+    child = [0] * (2 * n + 6)
+    child[0] = -2
+    child[1] = -4
+    free = 6
+    count = 0
+    w = 0
+    for c in seq:
+        t = child[w + c]
+        if t > 0:
+            w = t
+        else:
+            if t == 0:
+                child[w + c] = free
+                free += 2
+            else:
+                child[w + c] = -t
+            count += 1
+            w = 2 + 2 * c
+    return count
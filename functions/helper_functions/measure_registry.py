@@ -0,0 +1,108 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from functions.CopBET_DCC_entropy import _session_key, dcc_session
+from functions.CopBET_degree_distribution_entropy import degree_distribution_entropy
+from functions.CopBET_geodesic_entropy import geodesic_entropy
+from functions.CopBET_time_series_complexity import envelope_complexity
+from functions.helper_functions.correlation_graph import sorted_edges
+from functions.helper_functions.hilbert_envelope import hilbert_envelope
+from functions.helper_functions.sample_entropy import multiscale_sample_entropy
+
+Measure = namedtuple('Measure', ['columns', 'session_fun'])
+
+# name -> Measure. session_fun(intermediates, rng, params) returns {column: value}
+# for one session; group measures that need all sessions at once (metastate
+# clustering) have session_fun None and are handled by the batch runner.
+MEASURES = {}
+
+
+def register_measure(name, columns, session_fun=None):
+    """Adds a measure to the registry used by CopBET_entropy_batch."""
+    MEASURES[name] = Measure(tuple(columns), session_fun)
+
+
+class SessionIntermediates:
+    """
+    The data of one session (time x region) and the intermediates derived
+    from it. Every intermediate is computed the first time a measure asks for
+    it and shared with all other measures of the session. With an
+    IntermediateCache, intermediates are also looked up in (and added to) the
+    cache under (session key, name, parameters), so reruns and other
+    functions reuse them.
+    """
+
+    def __init__(self, ts, dtype=np.float64, cache=None, key=None):
+        self.ts = ts
+        self.dtype = np.dtype(dtype)
+        self.cache = cache
+        self.key = key
+        self._values = {}
+
+    def get(self, name, fun):
+        if name not in self._values:
+            if self.cache is not None:
+                self._values[name] = self.cache.get([self.key, name], fun)
+            else:
+                self._values[name] = fun()
+        return self._values[name]
+
+    def envelope(self):
+        return self.get(('envelope', self.dtype.name), lambda: hilbert_envelope(self.ts, axis=0, dtype=self.dtype))
+
+    def binary(self):
+        def binarise():
+            abs_hts = self.envelope()
+            return abs_hts > np.mean(abs_hts)
+        return self.get(('binary', self.dtype.name), binarise)
+
+    def edges(self, absolute=False):
+        """Correlation matrix and the edges sorted strongest first (see sorted_edges)."""
+        return self.get(('edges', absolute), lambda: sorted_edges(self.ts, absolute))
+
+
+def _lzc(inter, rng, params):
+    C, _, _ = envelope_complexity(inter.binary(), rng, params.get('LZtype', 'LZ78temporal'),
+                                  params.get('n_surrogates', 1))
+    return {'entropy_LZc': C}
+
+
+def _degree(inter, rng, params):
+    C, i, j = inter.edges(params.get('absolute', False))
+    return {'entropy_degree': degree_distribution_entropy(i, j, C.shape[0], _degrees(params))}
+
+
+def _geodesic(inter, rng, params):
+    C, i, j = inter.edges(params.get('absolute', True))
+    return {'entropy_pl': geodesic_entropy(i, j, C.shape[0], _degrees(params))}
+
+
+def _dcc(inter, rng, params):
+    n_bins, shard_size = params.get('n_bins'), params.get('shard_size', 2000)
+    shard_dir = None
+    if params.get('checkpoint_dir'):
+        shard_dir = os.path.join(params['checkpoint_dir'], _session_key(inter.ts, n_bins, shard_size))
+    # sessions already run in parallel, so the edge shards of one session run serially
+    H, V = dcc_session(np.asarray(inter.ts, dtype=np.float64), n_bins, shard_size, 0, shard_dir)
+    return {'dcc_entropy': H, 'dcc_var': V}
+
+
+def _sampen_roi(inter, rng, params):
+    # sample entropy of the region time series, as CopBET_sample_entropy gives for time x ROI input. That of
+    # volumes averages the voxelwise sample entropies within each region instead, which the batch cannot do
+    return {'entropy_sampen_roi': multiscale_sample_entropy(inter.ts, params.get('m', 2), params.get('r', 0.3),
+                                                        params.get('scales', range(1, 6)))}
+
+
+def _degrees(params):
+    return np.arange(1, 101) if params.get('degrees') is None else np.asarray(params['degrees'])
+
+
+register_measure('LZc', ['entropy_LZc'], _lzc)
+register_measure('metastate', ['entropy_metastate'])
+register_measure('degree', ['entropy_degree'], _degree)
+register_measure('pl', ['entropy_pl'], _geodesic)
+register_measure('dcc', ['dcc_entropy', 'dcc_var'], _dcc)
+register_measure('sampen_roi', ['entropy_sampen_roi'], _sampen_roi)
@@ -0,0 +1,150 @@
+import os
+import tempfile
+from functools import partial
+
+import numpy as np
+
+from functions.helper_functions.CopBET_run_sessions import CopBET_run_sessions
+
+
+def metastate_kmeans(X, k=4, distance='correlation', n_replicates=50, max_iter=1000, batch_size=None,
+                     num_workers=0, seed=None):
+    """
+    k-means clustering of the rows of X (time points) into metastates.
+
+    Mirrors MATLAB's kmeans(X, k, 'Distance', distance, 'Replicates', ...):
+    k-means++ starts, Lloyd iterations until the assignments stop changing,
+    empty clusters re-seeded at the point farthest from its centroid, and the
+    replicate with the lowest total distance is kept. The distances of all
+    points to all centroids are one matrix product per iteration, and the
+    replicates are spread over `num_workers` processes. With `batch_size`,
+    every replicate first runs mini-batch updates (Sculley, 2010) and is then
+    polished with full iterations, which converge in a few steps from there.
+
+    Args:
+        X (numpy.ndarray): time x ROI matrix, e.g. all sessions concatenated.
+        k (int, optional): Number of metastates. Defaults to 4.
+        distance (str, optional): 'correlation' or 'sqeuclidean'. Defaults to 'correlation'.
+        n_replicates (int, optional): Number of random starts. Defaults to 50.
+        max_iter (int, optional): Maximum iterations per replicate. Defaults to 1000.
+        batch_size (int, optional): Points per mini-batch update. Defaults to full batches.
+        num_workers (int, optional): Worker processes for the replicates. Defaults to 0.
+        seed (int or numpy.random.SeedSequence, optional): Seed for the starts. Defaults to fresh OS entropy.
+
+    Returns:
+        numpy.ndarray: The metastate (0..k-1) of every row of X.
+        numpy.ndarray: k x ROI centroids.
+        float: Total distance of the points to their centroids.
+    """
+    Xn = _prepare(X, distance)
+    replicate = partial(_kmeans_replicate, X=Xn, k=k, distance=distance, max_iter=max_iter, batch_size=batch_size)
+    results = CopBET_run_sessions(replicate, range(n_replicates), num_workers=num_workers, seed=seed, verbose=False)
+    labels, centroids, sumd = min(results, key=lambda r: r[2])
+    return labels, centroids, sumd
+
+
+def metastate_assign(X, centroids, distance='correlation'):
+    """Metastate of every row of X given fitted centroids, e.g. for new sessions."""
+    labels, _ = _assign(_prepare(X, distance), centroids)
+    return labels
+
+
+def load_centroids(file_path, k, n_rois, distance):
+    """Centroids stored by save_centroids, or None if the file is missing or was made with other settings."""
+    if not file_path or not os.path.exists(file_path):
+        return None
+    with np.load(file_path) as f:
+        centroids, stored_distance = f['centroids'], str(f['distance'])
+    if centroids.shape != (k, n_rois) or stored_distance != distance:
+        return None
+    return centroids
+
+
+def save_centroids(file_path, centroids, distance):
+    folder = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.npz.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, centroids=centroids, distance=distance)
+    os.replace(tmp, file_path)
+
+
+def _prepare(X, distance):
+    X = np.asarray(X, dtype=np.float64)
+    if distance == 'correlation':
+        # 1 - corr(x, c) is half the squared distance of the centred,
+        # unit-norm rows, so correlation k-means is k-means on those rows
+        X = X - X.mean(axis=1, keepdims=True)
+        X = X / np.linalg.norm(X, axis=1, keepdims=True)
+    elif distance != 'sqeuclidean':
+        raise ValueError(f"Unknown distance: {distance}. Available options: correlation, sqeuclidean")
+    return X
+
+
+def _assign(X, C):
+    # squared distances up to the constant |x|^2 of each row
+    D = (C ** 2).sum(axis=1) - 2 * X @ C.T
+    labels = D.argmin(axis=1)
+    point_d = D[np.arange(len(X)), labels] + (X ** 2).sum(axis=1)
+    return labels, np.maximum(point_d, 0)
+
+
+def _centroids(X, labels, k, distance, old):
+    counts = np.bincount(labels, minlength=k)
+    C = np.zeros((k, X.shape[1]))
+    np.add.at(C, labels, X)
+    C[counts > 0] /= counts[counts > 0, None]
+    C[counts == 0] = old[counts == 0]
+    return _normalise(C, distance), counts
+
+
+def _normalise(C, distance):
+    if distance == 'correlation':
+        C = C - C.mean(axis=1, keepdims=True)
+        C = C / np.linalg.norm(C, axis=1, keepdims=True)
+    return C
+
+
+def _kmeans_plusplus(X, k, rng):
+    C = np.empty((k, X.shape[1]))
+    C[0] = X[rng.integers(len(X))]
+    d = ((X - C[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        C[i] = X[rng.choice(len(X), p=d / d.sum())] if d.sum() > 0 else X[rng.integers(len(X))]
+        d = np.minimum(d, ((X - C[i]) ** 2).sum(axis=1))
+    return C
+
+
+def _kmeans_replicate(replicate, rng, X, k, distance, max_iter, batch_size):
+    C = _kmeans_plusplus(X, k, rng)
+
+    if batch_size and batch_size < len(X):
+        seen = np.zeros(k)
+        for _ in range(max_iter):
+            batch = X[rng.choice(len(X), batch_size, replace=False)]
+            labels, _ = _assign(batch, C)
+            old = C.copy()
+            for c in range(k):
+                members = batch[labels == c]
+                if len(members):
+                    seen[c] += len(members)
+                    C[c] += (members.sum(axis=0) - len(members) * C[c]) / seen[c]
+            C = _normalise(C, distance)
+            if np.abs(C - old).max() < 1e-6:
+                break
+
+    labels = None
+    for _ in range(max_iter):
+        new_labels, point_d = _assign(X, C)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        C, counts = _centroids(X, labels, k, distance, C)
+        for c in np.flatnonzero(counts == 0):
+            # empty cluster: restart it at the point farthest from its centroid
+            far = point_d.argmax()
+            C[c] = X[far]
+            labels[far] = c
+            point_d[far] = 0
+    labels, point_d = _assign(X, C)
+    return labels, C, float(point_d.sum())
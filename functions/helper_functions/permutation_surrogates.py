@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def permutation_surrogates(x, n_surrogates=1, rng=None):
+    """
+    Surrogates of x where every column is permuted independently along time.
+
+    All permutations are drawn at once by arg-sorting a block of random keys,
+    so there is no Python loop over columns or surrogates. The input is left
+    untouched.
+
+    Args:
+        x (numpy.ndarray): time x ROI (or time x voxel) matrix. Binarised input
+            gives the same result as binarising permuted data with a fixed
+            threshold, at a fraction of the memory.
+        n_surrogates (int, optional): Number of surrogates. Defaults to 1.
+        rng (numpy.random.Generator or int, optional): Random generator or seed.
+
+    Returns:
+        numpy.ndarray: n_surrogates x time x ROI array of surrogates.
+    """
+    rng = np.random.default_rng(rng)
+    x = np.asarray(x)
+    keys = rng.random((n_surrogates,) + x.shape, dtype=np.float32)
+    order = np.argsort(keys, axis=1)
+    return np.take_along_axis(x[np.newaxis], order, axis=1)
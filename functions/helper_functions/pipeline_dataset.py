@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+RUN_PATTERN = re.compile(r'^dat-(?P<dataset>.+)_sub-(?P<subject>[^_]+)_task-(?P<task>[^_]+)_ses-(?P<session>[^_]+)'
+                         r'_atlas-(?P<atlas>[^_]+)_conreg-(?P<conreg>[^_.]+)\.(?P<format>csv|npy)$')
+INDEX_FILE = '.pipeline_index.json'
+
+
+class PipelineDataset:
+    """
+    Lazy, filterable view of the runs in a pipeline_data folder.
+
+    The folder is indexed once by parsing the run file names
+    (dat-<dataset>_sub-<subject>_task-<task>_ses-<session>_atlas-<atlas>_conreg-<conreg>.csv/.npy).
+    The index is stored in the folder and only rebuilt when the folder
+    changes. Arrays are read on demand, several files at a time, and the most
+    recently used runs are kept in memory.
+
+    Example:
+        ds = PipelineDataset('pipeline_data').filter(dataset='basel_LAM', atlas='yeo17', conreg='gsr')
+        tbl = CopBET_time_series_complexity(ds.to_table(), 'LZ78temporal')
+
+    Args:
+        folder (str): The pipeline_data folder.
+        dtype (numpy.dtype, optional): dtype of the loaded arrays. Defaults to np.float64.
+        cache_size (int, optional): Number of runs kept in memory. Defaults to 32.
+        n_threads (int, optional): Files parsed in parallel. Defaults to 8.
+    """
+
+    def __init__(self, folder, dtype=np.float64, cache_size=32, n_threads=8, index=None):
+        self.folder = os.path.abspath(folder)
+        self.dtype = np.dtype(dtype)
+        self.cache_size = cache_size
+        self.n_threads = n_threads
+        self.index = _load_index(self.folder) if index is None else index
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return f"PipelineDataset({self.folder!r}, {len(self)} runs)"
+
+    def filter(self, **filters):
+        """Subset of the runs, e.g. filter(dataset='basel_LAM', atlas=['yeo17', 'schaefer400']). Nothing is loaded."""
+        index = self.index
+        for column, value in filters.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            index = index[index[column].isin([str(v) for v in values])]
+        subset = PipelineDataset(self.folder, self.dtype, self.cache_size, self.n_threads, index.reset_index(drop=True))
+        subset._cache, subset._lock = self._cache, self._lock  # views of the same folder share the loaded runs
+        return subset
+
+    def paths(self):
+        return [os.path.join(self.folder, f) for f in self.index['file']]
+
+    def __getitem__(self, i):
+        """time x ROI array of the i-th run."""
+        return self._load(self.paths()[i])
+
+    def load_all(self):
+        """Arrays of all runs, in index order, parsed by a thread pool."""
+        paths = self.paths()
+        with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            return list(pool.map(self._load, paths))
+
+    def to_table(self, load=True):
+        """
+        Table with the data in the first column followed by the metadata, as
+        CopBET functions expect. With load=False the data column holds the
+        file paths and every session is read by whoever processes it.
+        """
+        data = self.load_all() if load else self.paths()
+        return pd.concat([pd.DataFrame({'data': data}), self.index.drop(columns=['file', 'format'])], axis=1)
+
+    def _load(self, path):
+        # called from the load_all threads: the cache is only touched under the lock, the files are read outside it
+        with self._lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                return self._cache[path]
+        arr = load_run(path, self.dtype)
+        with self._lock:
+            self._cache[path] = arr
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return arr
+
+
+def load_run(path, dtype=np.float64):
+    """Reads one pipeline_data run (.csv with Region_i columns, or .npy) as a time x ROI array."""
+    if path.endswith('.npy'):
+        return np.load(path).astype(dtype, copy=False)
+    return pd.read_csv(path, engine=_CSV_ENGINE, dtype=dtype).to_numpy()
+
+
+def _load_index(folder):
+    index_path = os.path.join(folder, INDEX_FILE)
+    folder_mtime = os.stat(folder).st_mtime_ns
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            stored = json.load(f)
+        if stored.get('folder_mtime_ns') == folder_mtime:
+            return pd.DataFrame(stored['runs'], columns=list(RUN_PATTERN.groupindex) + ['file'])
+
+    runs = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            match = RUN_PATTERN.match(entry.name)
+            if match and entry.is_file():
+                runs.append({**match.groupdict(), 'file': entry.name})
+    runs.sort(key=lambda run: run['file'])
+    try:
+        with open(index_path, 'w') as f:
+            json.dump({'folder_mtime_ns': os.stat(folder).st_mtime_ns, 'runs': runs}, f)
+    except OSError:  # read-only folder, index again next time
+        pass
+    return pd.DataFrame(runs, columns=list(RUN_PATTERN.groupindex) + ['file'])
+
+
+try:
+    import pyarrow  # noqa: F401
+    _CSV_ENGINE = 'pyarrow'
+except ImportError:
+    _CSV_ENGINE = 'c'
@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+from scipy.io import loadmat
+
+
+def load_roi_mats(paths, variable='V_roi', n_threads=8, cache_file=None):
+    """
+    Reads one variable (time x ROI matrix) from each of a list of .mat files.
+
+    The files are read by a thread pool. With cache_file, all matrices are
+    also stored consolidated in <cache_file>.npy (stacked along time) with
+    the file names, sizes, modification times and row offsets in
+    <cache_file>.json. Later calls with the same, unchanged files
+    memory-map that single file and return views of it instead of parsing
+    every .mat file again.
+
+    Args:
+        paths (list): The .mat files.
+        variable (str, optional): Name of the matrix in the files. Defaults to 'V_roi'.
+        n_threads (int, optional): Files read in parallel. Defaults to 8.
+        cache_file (str, optional): Path of the consolidated cache, without extension. Defaults to none.
+
+    Returns:
+        list: The matrices, in the order of paths.
+    """
+    signature = [[os.path.basename(p), os.stat(p).st_size, os.stat(p).st_mtime_ns] for p in paths]
+    if cache_file:
+        cached = _read_cache(cache_file, variable, signature)
+        if cached is not None:
+            return cached
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        arrays = list(pool.map(partial(_load_variable, variable=variable), paths))
+
+    if cache_file:
+        _write_cache(cache_file, variable, signature, arrays)
+    return arrays
+
+
+def _load_variable(path, variable):
+    return loadmat(path, variable_names=[variable])[variable]
+
+
+def _read_cache(cache_file, variable, signature):
+    try:
+        with open(cache_file + '.json') as f:
+            stored = json.load(f)
+        if stored['variable'] != variable or stored['files'] != signature:
+            return None
+        data = np.load(cache_file + '.npy', mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    offsets = stored['offsets']
+    if data.shape[0] != offsets[-1]:  # written by a concurrent, different load
+        return None
+    return [data[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def _write_cache(cache_file, variable, signature, arrays):
+    # only matrices that stack along time can be consolidated
+    if any(a.ndim != 2 or a.shape[1] != arrays[0].shape[1] or a.dtype != arrays[0].dtype for a in arrays):
+        print(f'Warning: {variable} differs in shape or type between files, not caching')
+        return
+    offsets = np.concatenate([[0], np.cumsum([a.shape[0] for a in arrays])]).tolist()
+    folder = os.path.dirname(os.path.abspath(cache_file))
+    try:
+        # written to temporary names first, readers never see a partial cache
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.npy.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.concatenate(arrays, axis=0))
+        os.replace(tmp, cache_file + '.npy')
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.json.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'variable': variable, 'files': signature, 'offsets': offsets}, f)
+        os.replace(tmp, cache_file + '.json')
+    except OSError:  # read-only folder, read the .mat files again next time
+        pass
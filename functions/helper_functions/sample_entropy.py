@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def multiscale_sample_entropy(X, m=2, r=0.3, scales=range(1, 6), chunk_size=4096):
+    """
+    Multiscale sample entropy (Costa et al., 2002) of every column of X.
+
+    Sample entropy (Richman & Moorman, 2000) is -log(A / B), where B counts
+    the pairs of length-m templates within tolerance r (Chebyshev distance,
+    self-matches excluded) and A the pairs that still match at length m+1.
+    Instead of comparing templates one series at a time, all pairs at the
+    same lag are compared for a whole chunk of series at once: the
+    element-wise matches |x[t] - x[t+lag]| <= r are computed once per lag
+    and combined into the length-m and length-m+1 matches, so the m+1
+    embedding is never built separately.
+
+    The coarse-grained series of all scales come from one cumulative sum,
+    and r is a fraction of the standard deviation of the original series
+    at every scale, as in Costa et al.
+
+    Args:
+        X (numpy.ndarray): time x series matrix (voxels or ROIs).
+        m (int, optional): Template length. Defaults to 2.
+        r (float, optional): Tolerance as a fraction of the standard
+            deviation. Defaults to 0.3.
+        scales (iterable of int, optional): Coarse-graining scales. Defaults to 1..5.
+        chunk_size (int, optional): Series compared at a time. Defaults to 4096.
+
+    Returns:
+        numpy.ndarray: scale x series matrix of sample entropies. inf where no
+        template matches at length m+1, NaN where none matches at length m.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    scales = list(scales)
+    out = np.empty((len(scales), X.shape[1]))
+    for start in range(0, X.shape[1], chunk_size):
+        chunk = X[:, start:start + chunk_size].T  # series x time
+        tol = r * chunk.std(axis=1, ddof=1)[:, None]
+        csum = np.concatenate((np.zeros((chunk.shape[0], 1)), np.cumsum(chunk, axis=1)), axis=1)
+        for s, scale in enumerate(scales):
+            n = chunk.shape[1] // scale
+            coarse = (csum[:, scale:(n + 1) * scale:scale] - csum[:, 0:n * scale:scale]) / scale
+            A, B = _match_counts(coarse, m, tol)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[s, start:start + chunk.shape[0]] = -np.log(A / B)
+    return out
+
+
+def _match_counts(x, m, tol):
+    # A and B of every row of x, summed over all lags
+    n = x.shape[1]
+    n_templates = n - m
+    A = np.zeros(x.shape[0])
+    B = np.zeros(x.shape[0])
+    for lag in range(1, n_templates):
+        L = n_templates - lag
+        close = np.abs(x[:, lag:] - x[:, :-lag]) <= tol
+        match = close[:, :L].copy()
+        for k in range(1, m):
+            match &= close[:, k:k + L]
+        B += match.sum(axis=1)
+        A += (match & close[:, m:m + L]).sum(axis=1)
+    return A, B
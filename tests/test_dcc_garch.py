@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import loadmat
+from scipy.optimize import minimize
+
+from functions import CopBET_DCC_entropy, PipelineDataset
+from functions.helper_functions import dcc_garch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE = os.path.join(ROOT, 'Analysis', 'tbl_struct.mat')
+
+
+def _simulate_garch(T, a, b, rng, n):
+    eps = np.empty((T, n))
+    h = np.ones(n)
+    for t in range(T):
+        eps[t] = np.sqrt(h) * rng.standard_normal(n)
+        h = (1 - a - b) + a * eps[t] ** 2 + b * h
+    return eps
+
+
+def _simulate_dcc(T, a, b, rho, rng, n):
+    Qbar = np.array([[1, rho], [rho, 1]])
+    Q = np.tile(Qbar, (n, 1, 1))
+    z = np.empty((T, n, 2))
+    for t in range(T):
+        d = np.sqrt(np.einsum('nii->ni', Q))
+        L = np.linalg.cholesky(Q / (d[:, :, None] * d[:, None, :]))
+        z[t] = np.einsum('nij,nj->ni', L, rng.standard_normal((n, 2)))
+        Q = (1 - a - b) * Qbar + a * np.einsum('ni,nj->nij', z[t], z[t]) + b * Q
+    return z[..., 0], z[..., 1]
+
+
+def _scipy_optimum(f):
+    # best of several Nelder-Mead runs on the feasible region
+    def objective(x):
+        a, b = x
+        if a < 0 or b < 0 or a + b >= dcc_garch._MAX_PERSISTENCE:
+            return np.inf
+        return f(a, b)
+    starts = [(0.05, 0.9), (0.1, 0.8), (0.2, 0.6), (0.02, 0.97), (0.3, 0.3)]
+    return min(minimize(objective, x0, method='Nelder-Mead',
+                        options=dict(xatol=1e-9, fatol=1e-10, maxiter=5000)).fun for x0 in starts)
+
+
+@pytest.mark.parametrize('a, b', [(0.1, 0.85), (0.05, 0.94), (0.25, 0.7)])
+def test_garch_fit_reaches_scipy_optimum(a, b):
+    eps = _simulate_garch(300, a, b, np.random.default_rng(0), 6)
+    ab, _ = dcc_garch.garch_fit(eps)
+    e2 = eps ** 2
+    var = e2.mean(axis=0)
+    for k in range(eps.shape[1]):
+        def f(a, b):
+            return dcc_garch._garch_nll(e2[:, [k]], var[[k]], np.array([[a]]), np.array([[b]]))[0, 0]
+        assert f(*ab[k]) <= _scipy_optimum(f) + 1e-5
+
+
+def test_dcc_fit_reaches_scipy_optimum():
+    z1, z2 = _simulate_dcc(300, 0.05, 0.93, 0.3, np.random.default_rng(1), 4)
+    ab, _ = dcc_garch.dcc_fit(z1, z2)
+    moments = (z1 * z1, z2 * z2, z1 * z2)
+    for k in range(z1.shape[1]):
+        pair = tuple(m[:, [k]] for m in moments)
+
+        def f(a, b):
+            return dcc_garch._dcc_recursion(pair, np.array([[a]]), np.array([[b]]), want_rho=False)[0, 0]
+        assert f(*ab[k]) <= _scipy_optimum(f) + 1e-5
+
+
+@pytest.mark.skipif(not os.path.exists(REFERENCE), reason='MATLAB reference table not available')
+def test_dcc_entropy_matches_matlab_outputs():
+    ref = loadmat(REFERENCE, squeeze_me=True, struct_as_record=False)['tbl_struct']
+    rows = {os.path.basename(path.replace('\\', '/')): r for r, path in enumerate(ref.data)}
+
+    dataset = PipelineDataset(os.path.join(ROOT, 'pipeline_data')).filter(atlas='yeo17')
+    out = CopBET_DCC_entropy(dataset.to_table(), parallel=False)
+    i, j = np.triu_indices(17, 1)
+    matched = [rows[os.path.basename(path)] for path in dataset.paths()]
+    matlab_var = np.concatenate([ref.dcc_var[r][i, j] for r in matched])
+    matlab_entropy = np.concatenate([ref.dcc_entropy[r][i, j] for r in matched])
+    variance = np.concatenate([V[i, j] for V in out['variance']])
+    entropy = np.concatenate([H[i, j] for H in out['entropy']])
+
+    assert np.corrcoef(variance, matlab_var)[0, 1] > 0.95
+    # the entropies follow the fits: edges whose variance is within 1% of MATLAB's are within about 0.005, the
+    # others move with the (a, b) MATLAB's optimiser stopped at. As in MATLAB, edges whose likelihood is best at
+    # a = 0 still have a spread-out histogram
+    assert np.all(entropy > 1)
+    assert abs(entropy.mean() - matlab_entropy.mean()) < 0.02
+    assert np.median(np.abs(entropy - matlab_entropy)) < 0.03
+    assert np.corrcoef(entropy, matlab_entropy)[0, 1] > 0.5
@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import loadmat
+
+from functions import CopBET_geodesic_entropy, PipelineDataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE = os.path.join(ROOT, 'Analysis', 'tbl_struct.mat')
+
+
+@pytest.mark.skipif(not os.path.exists(REFERENCE), reason='MATLAB reference table not available')
+def test_geodesic_entropy_matches_matlab_outputs():
+    ref = loadmat(REFERENCE, squeeze_me=True, struct_as_record=False)['tbl_struct']
+    rows = {os.path.basename(path.replace('\\', '/')): r for r, path in enumerate(ref.data)}
+
+    dataset = PipelineDataset(os.path.join(ROOT, 'pipeline_data')).filter(atlas='yeo17')
+    matlab = np.vstack([ref.entropy_pl[rows[os.path.basename(path)]] for path in dataset.paths()])
+    entropy = np.vstack(CopBET_geodesic_entropy(dataset.to_table(), parallel=False)['entropy'])
+
+    # mean degree 1 is the empty graph
+    assert np.all(np.isnan(entropy[:, 0])) and np.all(np.isnan(matlab[:, 0]))
+    # from mean degree 17 (the number of ROIs) on every edge is kept; MATLAB's values keep changing there, which
+    # is not reproduced
+    assert np.all(entropy[:, 16:] == entropy[:, 16:17])
+
+    # below that, a quarter of the values are identical and the others differ by a few hundredths
+    python, matlab = entropy[:, 1:16].ravel(), matlab[:, 1:16].ravel()
+    assert np.corrcoef(python, matlab)[0, 1] > 0.9
+    assert np.mean(np.abs(python - matlab)) < 0.08
+    assert np.mean(np.abs(python - matlab) < 1e-9) > 0.25
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import loadmat
+
+from functions import CopBET_metastate_series_complexity, PipelineDataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE = os.path.join(ROOT, 'Analysis', 'tbl_struct.mat')
+
+
+@pytest.mark.skipif(not os.path.exists(REFERENCE), reason='MATLAB reference table not available')
+def test_metastate_complexity_matches_matlab_outputs():
+    # The MATLAB run clustered all 1066 sessions of Analysis/tbl_struct.mat, of which only the basel_LAM sub-01
+    # yeo17 runs are in pipeline_data, and its permutations are random, so the sessions cannot be matched one by
+    # one. The distribution of the scores is compared with that of the MATLAB basel_LAM scores instead.
+    ref = loadmat(REFERENCE, squeeze_me=True, struct_as_record=False)['tbl_struct']
+    matlab = ref.entropy_metastate[ref.dataset == 'basel_LAM']
+
+    tbl = PipelineDataset(os.path.join(ROOT, 'pipeline_data')).filter(atlas='yeo17').to_table()
+    scores = np.concatenate([CopBET_metastate_series_complexity(tbl, parallel=False, replicates=10, seed=seed)['entropy']
+                             for seed in range(5)])
+
+    assert abs(scores.mean() - matlab.mean()) < 0.03
+    assert abs(scores.std() - matlab.std()) < 0.03
+    assert np.mean(scores > 1) > 0.6